@@ -0,0 +1,171 @@
+"""Synthetic benchmark of the ingest, dedup, retrieval, MMR and compose phases."""
+from __future__ import annotations
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from .engine import ContextEngine
+from .embeddings import HashEmbedder, LocalEmbedder
+from .retrieval import hybrid_search, mmr_select
+from .vector_index import ExactIndex, faiss
+
+try:
+    import resource
+except Exception:  # pragma: no cover - not available on Windows
+    resource = None
+
+_TOPICS = ["loader", "auth", "router", "cache", "schema", "deploy", "search", "upload", "billing", "theme",
+           "webhook", "session", "metrics", "queue", "locale", "editor", "sitemap", "onboarding", "export", "api"]
+_VERBS = ["add", "fix", "refactor", "remove", "document", "test", "rename", "split", "speed up", "migrate"]
+_FILES = ["src/app.ts", "src/routes.ts", "lib/db.py", "lib/auth.py", "api/server.go", "web/index.astro",
+          "web/styles.css", "jobs/worker.py", "infra/main.tf", "README.md"]
+_WORDS = ("the a progress spinner error retry timeout config flag user page build token cookie index query table "
+          "column field handler request response status payload layout button modal toast banner color font "
+          "script bundle image cdn region latency throughput memory disk log trace alert").split()
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "si", "de", "po", "gu", "ze", "an", "el", "or", "ix"]
+
+
+def _vocabulary(size: int = 5000) -> Tuple[List[str], List[float]]:
+    # common words first, then pseudo-words; Zipf weights give realistic posting-list lengths
+    rng = random.Random(1234)
+    words = list(_WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    cum, total = [], 0.0
+    for rank in range(len(words)):
+        total += 1.0 / (rank + 1)
+        cum.append(total)
+    return words, cum
+
+
+_VOCAB, _CUM = _vocabulary()
+
+
+def _text(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choices(_VOCAB, cum_weights=_CUM, k=n))
+
+
+def synthetic_pairs(n: int, seed: int = 0, repeat: float = 0.2) -> Iterator[Tuple[str, str]]:
+    """``n`` deterministic (user, assistant) exchanges; about ``repeat`` of them restate an earlier one."""
+    rng = random.Random(seed)
+    seen: List[Tuple[str, str]] = []
+    for i in range(n):
+        if seen and rng.random() < repeat:
+            yield seen[rng.randrange(len(seen))]
+            continue
+        topic, verb, path = rng.choice(_TOPICS), rng.choice(_VERBS), rng.choice(_FILES)
+        detail = _text(rng, rng.randint(6, 18))
+        user = f"{verb} the {topic} in {path}. {detail}"
+        if rng.random() < 0.2:
+            user = f"decide: {verb} {topic} #{i % 97}\n{user}"
+        answer = _text(rng, rng.randint(8, 24))
+        assistant = f"Updated {path} for the {topic}. {answer}"
+        if rng.random() < 0.2:
+            assistant += f"\ntodo: {rng.choice(_VERBS)} {topic} tests"
+        pair = (user, assistant)
+        if len(seen) < 4096:
+            seen.append(pair)
+        yield pair
+
+
+def synthetic_queries(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [f"{rng.choice(_VERBS)} {rng.choice(_TOPICS)} {_text(rng, 3)}" for _ in range(n)]
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(samples: List[float], items: Optional[int] = None) -> Dict[str, float]:
+    """Per-call latency percentiles in ms, and ``items`` (default: calls) processed per second."""
+    arr = np.asarray(samples, dtype=np.float64)
+    total = float(arr.sum())
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99]) * 1000 if len(arr) else (0.0, 0.0, 0.0)
+    items = len(arr) if items is None else items
+    return {"calls": len(arr), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99),
+            "per_sec": items / total if total > 0 else 0.0}
+
+
+def _timed(fn: Callable, args: List) -> Tuple[List[float], List]:
+    times, out = [], []
+    for a in args:
+        start = time.perf_counter()
+        out.append(fn(a))
+        times.append(time.perf_counter() - start)
+    return times, out
+
+
+def run(chunks: int = 1000, queries: int = 200, batch_size: int = 512, seed: int = 0, embedder: str = "local",
+        vector_search: str = "hnsw", workdir: Optional[str] = None, k: int = 5, vec_dtype: str = "float32") -> dict:
+    """Build a corpus of about ``chunks`` FS chunks, then time each phase; returns a JSON-ready report.
+
+    Ingest runs with ``vector_search``. Query phases run against both the exact index and
+    HNSW (when FAISS is installed) over the same store, and report HNSW recall@k.
+    With ``vec_dtype`` the vectors are stored and indexed quantized; the report then
+    includes the store footprint and the quantized recall estimate.
+    """
+    tmp = None
+    if workdir is None:
+        tmp = tempfile.TemporaryDirectory(prefix="context-bench-")
+        workdir = tmp.name
+    try:
+        emb = HashEmbedder() if embedder == "hash" else LocalEmbedder()
+        eng = ContextEngine(db_path=os.path.join(workdir, "bench.db"), embedder=emb, vector_search=vector_search,
+                            embedding_cache=False, compose_cache_size=0, vec_dtype=vec_dtype)
+        report: dict = {"config": {"chunks": chunks, "queries": queries, "batch_size": batch_size, "seed": seed,
+                                   "embedder": embedder, "vector_search": vector_search, "vec_dtype": vec_dtype}}
+        # ingest: two summaries per exchange, so chunks/2 exchanges (repeats merge instead)
+        pairs = list(synthetic_pairs(max(1, chunks // 2), seed))
+        batches = [pairs[i:i + batch_size] for i in range(0, len(pairs), batch_size)]
+        times, reports = _timed(lambda b: eng.update_memory_many(b, batch_size=batch_size), batches)
+        # latency per batch, throughput in exchanges
+        report["ingest"] = dict(summarize(times, items=len(pairs)),
+                                chunks_new=sum(r["chunks_new"] for r in reports),
+                                chunks_merged=sum(r["chunks_merged"] for r in reports))
+        report["fs_chunks"] = eng.store.count_fs()
+        qtexts = synthetic_queries(queries, seed + 1)
+        qvecs = eng.embedder.encode(qtexts)
+        indexes = {"exact": ExactIndex(eng.store)}
+        if faiss is not None and vector_search == "hnsw":
+            indexes["hnsw"] = eng.vindex
+        # dedup: the batched top-1 lookup each ingest batch makes
+        dedup_vecs = eng.embedder.encode([p[0] for p in pairs[:batch_size]])
+        report["dedup"] = {name: summarize(_timed(lambda v: index.search_many(v, 1), [dedup_vecs] * 20)[0],
+                                           items=20 * len(dedup_vecs))
+                           for name, index in indexes.items()}
+        report["retrieval"], report["compose"] = {}, {}
+        dl = eng.store.load_ledger()
+        for name, index in indexes.items():
+            times, _ = _timed(lambda q: hybrid_search(q, dl, None, eng.embedder, k=k, store=eng.store,
+                                                               vindex=index), qtexts)
+            report["retrieval"][name] = summarize(times)
+            eng.vindex = index
+            report["compose"][name] = summarize(_timed(eng.compose_context, qtexts)[0])
+        eng.vindex = indexes.get(vector_search, indexes["exact"])
+        # MMR alone, over each query's top-64 exact candidates
+        pools = []
+        for q, top in zip(qvecs, indexes["exact"].search_many(qvecs, 64)):
+            pools.append((q, np.vstack([eng.store.vector(cid) for cid, _ in top]) if top else np.zeros((0, 1))))
+        report["mmr"] = summarize(_timed(lambda p: mmr_select(p[0], p[1], k), pools)[0])
+        if "hnsw" in indexes:
+            exact_top = indexes["exact"].search_many(qvecs, k)
+            hnsw_top = indexes["hnsw"].search_many(qvecs, k)
+            overlap = [len({c for c, _ in a} & {c for c, _ in b}) / max(1, len(a)) for a, b in zip(exact_top, hnsw_top)]
+            report["hnsw_recall_at_k"] = float(np.mean(overlap)) if overlap else None
+        report["vectors"] = eng.store.vector_stats()
+        if vec_dtype != "float32":
+            report["quantization"] = eng.quantization_recall(k=k)
+        report["peak_rss_mb"] = peak_rss_mb()
+        eng.close()
+        return report
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
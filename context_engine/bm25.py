@@ -0,0 +1,58 @@
+"""BM25 scoring over an inverted index (postings + doc lengths)."""
+from __future__ import annotations
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import math
+
+K1 = 1.5
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return text.lower().split()
+
+def doc_text(text: str, tags: List[str]) -> str:
+    return f"{text} {' '.join(tags)}"
+
+def term_counts(text: str) -> Dict[str, int]:
+    return dict(Counter(tokenize(text)))
+
+def idf(n_docs: int, df: int) -> float:
+    # Lucene-style idf: always positive, needs no corpus-wide average
+    return math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+def score(query_terms: Iterable[str], postings: Dict[str, List[Tuple[str, int]]],
+          doc_lens: Dict[str, int], n_docs: int, total_len: int,
+          df: Optional[Dict[str, int]] = None) -> Dict[str, float]:
+    """Score only the docs that appear in the postings of ``query_terms``.
+
+    ``df`` gives document frequencies when ``postings`` covers only part of the corpus.
+    """
+    if n_docs <= 0:
+        return {}
+    avgdl = total_len / n_docs or 1.0
+    scores: Dict[str, float] = {}
+    for term, qtf in Counter(query_terms).items():
+        plist = postings.get(term)
+        if not plist:
+            continue
+        w = qtf * idf(n_docs, len(plist) if df is None else df[term])
+        for doc_id, tf in plist:
+            norm = K1 * (1 - B + B * doc_lens.get(doc_id, 0) / avgdl)
+            scores[doc_id] = scores.get(doc_id, 0.0) + w * tf * (K1 + 1) / (tf + norm)
+    return scores
+
+
+class MemoryIndex:
+    """Throwaway in-memory index for callers without a Store."""
+    def __init__(self, docs: Dict[str, str]):
+        self.postings: Dict[str, List[Tuple[str, int]]] = {}
+        self.doc_lens: Dict[str, int] = {}
+        for doc_id, text in docs.items():
+            counts = term_counts(text)
+            self.doc_lens[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+
+    def bm25_scores(self, query_terms: List[str]) -> Dict[str, float]:
+        return score(query_terms, self.postings, self.doc_lens, len(self.doc_lens), sum(self.doc_lens.values()))
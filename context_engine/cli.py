@@ -1,11 +1,17 @@
 """Minimal CLI demo for context engine."""
 from __future__ import annotations
 import argparse
+import itertools
+import json
 from .engine import ContextEngine
+from .importers import iter_pairs
 
 
 def main():
     parser = argparse.ArgumentParser(prog="context-engine")
+    parser.add_argument("--session", default="default", help="conversation to read and write")
+    parser.add_argument("--vec-dtype", choices=["float32", "float16", "int8"],
+                        help="store this session's vectors quantized (converts an existing session)")
     sub = parser.add_subparsers(dest="cmd")
 
     ing = sub.add_parser("ingest")
@@ -14,20 +20,69 @@ def main():
 
     comp = sub.add_parser("compose")
     comp.add_argument("--next", required=True)
+    comp.add_argument("--tag", action="append", dest="tags", help="only retrieve chunks with this tag (repeatable)")
 
-    sub.add_parser("stats")
+    st = sub.add_parser("stats")
+    st.add_argument("--recall", type=int, metavar="K", help="also estimate quantized recall@K on a chunk sample")
+
+    imp = sub.add_parser("import")
+    imp.add_argument("paths", nargs="+", help="history.json or .jsonl files")
+    imp.add_argument("--batch-size", type=int, default=512)
+
+    cmp = sub.add_parser("compact", help="merge near-duplicate chunks, evict stale ones, rebuild indexes")
+    cmp.add_argument("--threshold", type=float, help="merge cosine (default: the dedup threshold)")
+    cmp.add_argument("--max-age-days", type=float, default=30.0)
+    cmp.add_argument("--min-hits", type=int, default=1, help="older chunks with fewer hits are evicted")
+    cmp.add_argument("--max-chunks", type=int, help="keep at most this many chunks")
+
+    srv = sub.add_parser("serve", help="keep engines warm behind a local JSON API")
+    srv.add_argument("--host", default="127.0.0.1")
+    srv.add_argument("--port", type=int, default=8765)
+    srv.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    srv.add_argument("--workers", type=int, default=8)
+    srv.add_argument("--max-sessions", type=int, default=64, help="warm engines kept open")
+
+    bench = sub.add_parser("bench", help="time each phase on a synthetic corpus; prints JSON")
+    bench.add_argument("--chunks", type=int, default=1000, help="approximate corpus size in FS chunks")
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--batch-size", type=int, default=512)
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--embedder", choices=["local", "hash"], default="local")
+    bench.add_argument("--vector-search", choices=["hnsw", "exact"], default="hnsw")
+    bench.add_argument("--vec-dtype", dest="bench_vec_dtype", choices=["float32", "float16", "int8"],
+                       default="float32")
+    bench.add_argument("--dir", help="keep the benchmark database here instead of a temp dir")
 
     args = parser.parse_args()
-    engine = ContextEngine()
+    if args.cmd == "bench":
+        from .bench import run
+        print(json.dumps(run(args.chunks, args.queries, args.batch_size, args.seed, args.embedder,
+                             args.vector_search, args.dir, vec_dtype=args.bench_vec_dtype), indent=2))
+        return
+    if args.cmd == "serve":
+        from .server import serve
+        serve(args.host, args.port, args.unix, workers=args.workers, max_engines=args.max_sessions,
+              vec_dtype=args.vec_dtype)
+        return
+    engine = ContextEngine(session_id=args.session, vec_dtype=args.vec_dtype)
     if args.cmd == "ingest":
         engine.update_memory(args.user, args.assistant)
     elif args.cmd == "compose":
-        ctx = engine.compose_context(args.next)
+        ctx = engine.compose_context(args.next, args.tags)
         print(ctx)
     elif args.cmd == "stats":
-        print(engine.stats())
+        stats = engine.stats()
+        if args.recall:
+            stats["quantization"] = engine.quantization_recall(k=args.recall)
+        print(stats)
+    elif args.cmd == "import":
+        pairs = itertools.chain.from_iterable(iter_pairs(p) for p in args.paths)
+        print(json.dumps(engine.update_memory_many(pairs, batch_size=args.batch_size)))
+    elif args.cmd == "compact":
+        print(json.dumps(engine.compact(args.threshold, args.max_age_days, args.min_hits, args.max_chunks), indent=2))
     else:
         parser.print_help()
+    engine.close()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,23 @@
 """Embedding interfaces."""
 from __future__ import annotations
-from typing import List
+from collections import OrderedDict
+from typing import Dict, List, Tuple
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import os
+import random
+import threading
+import time
 
 class Embedder:
     def encode(self, texts: List[str]) -> np.ndarray:  # pragma: no cover - interface
         raise NotImplementedError
 
+    def cache_id(self) -> Tuple[str, str]:
+        """(embedder id, model) identifying the vector space, used as the cache namespace."""
+        return type(self).__name__, str(getattr(self, "model", getattr(self, "dim", "")))
+
 class HashEmbedder(Embedder):
     """Deterministic hash-based embeddings for tests."""
     def __init__(self, dim: int = 64):
@@ -28,19 +37,248 @@ class HashEmbedder(Embedder):
         norms = np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9
         return mat / norms
 
+class LocalEmbedder(Embedder):
+    """Offline embeddings from hashed word and char n-grams with a sparse random projection.
+
+    Texts are lower-cased and concatenated into one byte buffer, so word uni/bigrams and
+    byte-level char n-grams are hashed with numpy over the whole batch at once. Each hashed
+    feature is projected into ``dim`` buckets by ``hashes`` signed hash functions (a
+    count-sketch style sparse random projection). Texts sharing words or word fragments get
+    positive cosine similarity. Stateless and seeded, so vectors are stable across processes.
+    """
+    _P = np.uint64(1099511628211)
+    _P_INV = np.uint64(pow(1099511628211, -1, 2**64))
+
+    def __init__(self, dim: int = 256, char_ngrams: Tuple[int, ...] = (3, 4, 5), hashes: int = 2, seed: int = 0):
+        self.dim = dim
+        self.model = f"ngram-srp-{dim}-{'.'.join(map(str, char_ngrams))}-{hashes}-{seed}"
+        self.char_ngrams = char_ngrams
+        rng = np.random.default_rng(seed)
+        # odd multipliers keep the multiply-shift hashes well mixed mod 2**64
+        self._mult = rng.integers(1, 2**62, size=hashes, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._add = rng.integers(0, 2**62, size=hashes, dtype=np.uint64)
+
+    def _project(self, doc_ids: np.ndarray, feats: np.ndarray, n_docs: int) -> np.ndarray:
+        out = np.zeros(n_docs * self.dim)
+        base = doc_ids * self.dim
+        for a, b in zip(self._mult, self._add):
+            # high bits of a multiply-shift hash: one for the sign, the rest for the bucket
+            h = ((feats * a + b) >> np.uint64(32)).astype(np.int64)
+            sign = (h & 1) * 2.0 - 1
+            out += np.bincount(base + (h >> 1) % self.dim, weights=sign, minlength=n_docs * self.dim)
+        out = out.reshape(n_docs, self.dim)
+        return out / (np.linalg.norm(out, axis=1, keepdims=True) + 1e-9)
+
+    def _char_features(self, buf: np.ndarray, owner: np.ndarray):
+        ids, feats = [], []
+        for n in self.char_ngrams:
+            m = len(buf) - n + 1
+            if m <= 0:
+                continue
+            h = np.full(m, n, dtype=np.uint64)
+            for j in range(n):
+                h = h * self._P + buf[j:j + m]
+            valid = (owner[:m] >= 0) & (owner[:m] == owner[n - 1:n - 1 + m])
+            ids.append(owner[:m][valid])
+            feats.append(h[valid])
+        if not ids:
+            # every text is shorter than the smallest n-gram
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+        return np.concatenate(ids), np.concatenate(feats)
+
+    def _word_features(self, buf: np.ndarray, owner: np.ndarray):
+        # polynomial hash of every [a-z0-9]+ run (non-ASCII bytes count as word chars) via
+        # prefix sums: hash(s..e) = P**e * (G[e] - G[s-1]) with G[i] = sum b[k] * P**-k
+        is_word = (buf >= 128) | ((buf >= 48) & (buf <= 57)) | ((buf >= 97) & (buf <= 122))
+        prev = np.concatenate([[False], is_word[:-1]])
+        nxt = np.concatenate([is_word[1:], [False]])
+        starts = np.flatnonzero(is_word & ~prev)
+        ends = np.flatnonzero(is_word & ~nxt)
+        if not len(starts):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+        ones = np.ones(len(buf), dtype=np.uint64)
+        powers = np.cumprod(np.concatenate([ones[:1], ones[1:] * self._P]), dtype=np.uint64)
+        inv_powers = np.cumprod(np.concatenate([ones[:1], ones[1:] * self._P_INV]), dtype=np.uint64)
+        prefix = np.cumsum(buf * inv_powers, dtype=np.uint64)
+        before = np.where(starts > 0, prefix[starts - 1], np.uint64(0))
+        uni = powers[ends] * (prefix[ends] - before)
+        doc = owner[starts]
+        same = doc[:-1] == doc[1:]
+        bi = uni[:-1][same] * self._P + uni[1:][same] + np.uint64(0x9E3779B97F4A7C15)
+        return np.concatenate([doc, doc[:-1][same]]), np.concatenate([uni, bi])
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        n = len(texts)
+        if not n:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        encoded = [t.lower().encode("utf-8") for t in texts]
+        lengths = np.array([len(b) for b in encoded], dtype=np.int64)
+        buf = np.frombuffer(b"\x00".join(encoded), dtype=np.uint8).astype(np.uint64)
+        # owning doc per byte; the separators belong to no doc
+        owner = np.repeat(np.arange(n), lengths + 1)[:len(buf)]
+        owner[np.cumsum(lengths + 1)[:-1] - 1] = -1
+        with np.errstate(over="ignore"):
+            chars = self._project(*self._char_features(buf, owner), n)
+            words = self._project(*self._word_features(buf, owner), n)
+        mat = chars + words
+        return (mat / (np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9)).astype(np.float32)
+
+
+def default_embedder() -> Embedder:
+    """The embedder ContextEngine uses when none is given."""
+    return LocalEmbedder()
+
+
 class OpenAIEmbedder(Embedder):
-    """Adapter for OpenAI embeddings API (not used in tests)."""
-    def __init__(self, model: str = "text-embedding-3-large"):
+    """Adapter for the OpenAI embeddings API.
+
+    Inputs are split into batches bounded by ``max_batch_tokens`` and ``max_batch_size``,
+    sent concurrently (up to ``concurrency``) over one keep-alive session, and retried
+    with exponential backoff on 429/5xx responses and connection errors. ``base_url``
+    (or ``OPENAI_BASE_URL``) points it at any compatible server.
+    """
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, model: str = "text-embedding-3-large", api_key: str = None, base_url: str = None,
+                 max_batch_tokens: int = 50_000, max_batch_size: int = 512, concurrency: int = 4,
+                 max_retries: int = 5, backoff: float = 0.5, timeout: float = 60.0):
+        import requests
+        from requests.adapters import HTTPAdapter
         self.model = model
-        self.api_key = os.getenv("OPENAI_API_KEY")
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise RuntimeError("OPENAI_API_KEY not set")
+        self.url = (base_url or os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/") + "/embeddings"
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._requests = requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"})
+
+    def _batches(self, texts: List[str]) -> List[List[int]]:
+        from .tokens import len_tokens_many
+        batches, current, used = [], [], 0
+        for i, n in enumerate(len_tokens_many(texts)):
+            if current and (used + n > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, used = [], 0
+            current.append(i)
+            used += n
+        if current:
+            batches.append(current)
+        return batches
+
+    def _post(self, inputs: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                resp = self.session.post(self.url, json={"input": inputs, "model": self.model}, timeout=self.timeout)
+            except self._requests.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                resp = None
+            if resp is not None and resp.status_code not in self.RETRY_STATUS:
+                resp.raise_for_status()
+                data = sorted(resp.json()["data"], key=lambda d: d["index"])
+                return [d["embedding"] for d in data]
+            if resp is not None and attempt == self.max_retries:
+                resp.raise_for_status()
+            delay = self.backoff * (2 ** attempt) * (1 + random.random() * 0.25)
+            retry_after = resp.headers.get("Retry-After") if resp is not None else None
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+            time.sleep(delay)
+        raise RuntimeError("unreachable")  # pragma: no cover
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batches = self._batches(texts)
+        out: List[List[float]] = [None] * len(texts)
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+            for idx, emb in zip(batches, pool.map(lambda b: self._post([texts[i] for i in b]), batches)):
+                for i, e in zip(idx, emb):
+                    out[i] = e
+        return np.array(out, dtype=np.float32)
+
+class CachedEmbedder(Embedder):
+    """Content-addressed cache in front of any Embedder.
+
+    Lookups go to an in-memory LRU first, then the Store's ``embedding_cache`` table keyed by
+    (embedder id, model, sha256(text)); only the remaining texts reach the wrapped embedder.
+    Vectors come back as float32. New vectors are written to the table only when its write
+    lock is free, so a lookup never waits on an ingest; the rest wait for ``flush()``.
+    """
+    def __init__(self, inner: Embedder, store=None, max_items: int = 4096):
+        self.inner = inner
+        self.store = store
+        self.max_items = max_items
+        self.embedder_id, self.model = inner.cache_id()
+        self._lru: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._unsaved: Dict[bytes, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_store = 0
+        self.misses = 0
+
+    def cache_id(self) -> Tuple[str, str]:
+        return self.embedder_id, self.model
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits_memory": self.hits_memory, "hits_store": self.hits_store, "misses": self.misses}
+
+    def _remember(self, key: bytes, vec: np.ndarray) -> None:
+        with self._lock:
+            self._lru[key] = vec
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        keys = [hashlib.sha256(t.encode("utf-8")).digest() for t in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            for k in keys:
+                vec = self._lru.get(k)
+                if vec is not None:
+                    self._lru.move_to_end(k)
+                    found[k] = vec
+                    self.hits_memory += 1
+        pending = {k: t for k, t in zip(keys, texts) if k not in found}
+        if pending and self.store is not None:
+            for k, vec in self.store.get_embeddings(self.embedder_id, self.model, list(pending)).items():
+                found[k] = vec
+                self._remember(k, vec)
+                self.hits_store += 1
+                del pending[k]
+        if pending:
+            fresh = np.asarray(self.inner.encode(list(pending.values())), dtype=np.float32)
+            self.misses += len(pending)
+            for k, vec in zip(pending, fresh):
+                found[k] = vec
+                self._remember(k, vec)
+            if self.store is not None:
+                with self._lock:
+                    self._unsaved.update(zip(pending, fresh))
+                self.flush(block=False)
+        return np.vstack([found[k] for k in keys])
 
-    def encode(self, texts: List[str]) -> np.ndarray:  # pragma: no cover - network
-        import requests, json
-        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
-        data = {"input": texts, "model": self.model}
-        resp = requests.post("https://api.openai.com/v1/embeddings", headers=headers, json=data)
-        resp.raise_for_status()
-        emb = [d["embedding"] for d in resp.json()["data"]]
-        return np.array(emb, dtype=float)
+    def flush(self, block: bool = True) -> None:
+        """Write vectors not yet in the store; with ``block=False``, only if its write lock is free."""
+        if self.store is None:
+            return
+        with self._lock:
+            items, self._unsaved = list(self._unsaved.items()), {}
+        if items and not self.store.put_embeddings(self.embedder_id, self.model, items, block=block):
+            with self._lock:
+                for k, vec in items:
+                    self._unsaved.setdefault(k, vec)
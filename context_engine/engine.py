@@ -1,111 +1,481 @@
 """High level Context Engine implementation."""
 from __future__ import annotations
+import itertools
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+import math
 import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
 from .store import Store
-from .embeddings import HashEmbedder, Embedder
-from .models import Turn, DecisionLedger, FSChunk
+from .embeddings import Embedder, CachedEmbedder, default_embedder
+from .models import Turn, FSChunk, DecisionLedger
 from . import extractors
 from . import reducers
 from . import retrieval
-from .tokens import len_tokens, cap_to_tokens
+from . import packer
+from . import quantize
+from .vector_index import open_vector_index
+from .tokens import len_tokens, cap_to_tokens, warm_up
 import yaml
 
+log = logging.getLogger(__name__)
+
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm > 0 else vec
+
+
 class ContextEngine:
     def __init__(self, db_path: str = "context.db", index_dir: str = "indexes", embedder: Embedder = None,
-                 ac_pairs:int=2, dl_cap_tokens:int=250, es_tokens:int=120, budget_tokens:int=900):
-        self.store = Store(db_path)
-        self.embedder = embedder or HashEmbedder()
+                 ac_pairs:int=2, dl_cap_tokens:int=250, es_tokens:int=120, budget_tokens:int=900,
+                 vector_search: str = "hnsw", dedup_threshold: float = 0.9, write_behind: float = 0.0,
+                 embedding_cache: bool = True, compose_cache_size: int = 256, session_id: str = "default",
+                 pack: bool = True, vec_dtype: Optional[str] = None):
+        # every session in a database has its own AC, ledger, chunks and vector index
+        self.store = Store(db_path, index_dir, write_behind=write_behind, session_id=session_id, vec_dtype=vec_dtype)
+        self.embedder = embedder or default_embedder()
+        if embedding_cache:
+            self.embedder = CachedEmbedder(self.embedder, self.store)
+        try:
+            self._check_embedder(explicit=embedder is not None)
+        except BaseException:
+            self.store.close()
+            raise
+        # "exact" (or no FAISS) scores the store's memory-mapped vector matrix directly
+        self.vindex = open_vector_index(self.store, name=f"{self.store.name}.fs", mode=vector_search)
+        self.vindex.sync(self.store)
+        self.dedup_threshold = dedup_threshold
+        warm_up()
         self.ac_pairs = ac_pairs
         self.dl_cap_tokens = dl_cap_tokens
         self.es_tokens = es_tokens
         self.budget_tokens = budget_tokens
+        # knapsack over turns, ledger entries and chunks; False keeps the fixed-priority stream
+        self.pack = pack
+        # (state_version, AC, DL): swapped as one tuple so threads never see a torn copy
+        self._hot = (-1, None, None)
+        # compose results keyed by (query, store versions, budgets); stale keys age out of the LRU
+        self.compose_cache_size = compose_cache_size
+        self._compose_cache: "OrderedDict[tuple, str]" = OrderedDict()
+        self._compose_lock = threading.Lock()
+        self.compose_hits = 0
+        self.compose_misses = 0
+        # chunk retrieval hits, written with the next ingest so compose never waits on the writer
+        self._pending_hits: Counter = Counter()
+        self._hits_lock = threading.Lock()
+        self._compactor = None
+        self._compactor_stop = threading.Event()
+
+    def _check_embedder(self, explicit: bool) -> None:
+        """Make sure the session's vectors come from ``self.embedder``.
+
+        An embedder passed explicitly re-embeds a session stored with another one; the
+        default refuses to, since it cannot know the session's embedder was left out by
+        mistake. Sessions from before embedders were recorded are kept when the dims agree.
+        """
+        ident = "/".join(self.embedder.cache_id())
+        stored = self.store.vec_embedder
+        if stored == ident:
+            return
+        if not self.store.count_vectors():
+            self.store.set_vec_embedder(ident)
+            return
+        if stored is None:
+            dim = self.embedder.encode(["dimension probe"]).shape[1]
+            if dim == self.store.vec_dim:
+                self.store.set_vec_embedder(ident)
+                return
+            stored = f"an unrecorded embedder (dim {self.store.vec_dim})"
+        elif not explicit:
+            raise ValueError(f"session {self.store.session_id!r} holds vectors from {stored}, not the default "
+                             f"{ident}; pass that embedder, or pass another one to re-embed the session with it")
+        log.warning("re-embedding %d chunks of session %r with %s; its vectors came from %s",
+                    self.store.count_vectors(), self.store.session_id, ident, stored)
+        chunks = self.store.load_fs_chunks()
+        parts = (chunks[i:i + 512] for i in range(0, len(chunks), 512))
+        self.store.replace_vectors((([c.id for c in part], self.embedder.encode([c.text for c in part]))
+                                    for part in parts), ident)
+
+    def _hot_state(self):
+        version = self.store.state_version()
+        cached, ac, dl = self._hot
+        if version != cached:
+            ac, dl = self.store.load_ac(), self.store.load_ledger()
+            self._hot = (version, ac, dl)
+        return ac, dl
 
     # -------- Update phase ---------
-    def update_memory(self, user_msg: str, assistant_msg: str) -> None:
-        # append raw turns
-        user_turn = Turn(role="user", text=user_msg)
-        assistant_turn = Turn(role="assistant", text=assistant_msg)
-        self.store.append_turn(user_turn)
-        turn_id = self.store.append_turn(assistant_turn)
-        # update AC
-        ac = self.store.load_ac()
-        ac.extend([user_turn, assistant_turn])
-        ac = ac[-self.ac_pairs*2:]
+    def update_memory(self, user_msg: str, assistant_msg: str) -> dict:
+        """Ingest one exchange; returns the stored FS chunk ids and which of them were merges.
+
+        The whole ingest is one Store transaction.
+        """
+        (turn_id,), chunks = self._ingest_batch([(user_msg, assistant_msg)])
+        return {"turn_id": turn_id, "chunks": chunks}
+
+    def update_memory_many(self, pairs: Iterable[Tuple[str, str]], batch_size: int = 512) -> dict:
+        """Bulk-ingest (user, assistant) pairs, e.g. from ``importers.iter_pairs``.
+
+        Each batch embeds its summaries in one call, dedups them with one batched index
+        query and commits as one transaction. Returns counts and throughput.
+        """
+        start = time.perf_counter()
+        report = {"pairs": 0, "chunks_new": 0, "chunks_merged": 0}
+        batch: List[Tuple[str, str]] = []
+        for pair in itertools.chain(pairs, [None]):
+            if pair is not None:
+                batch.append(pair)
+            if batch and (pair is None or len(batch) >= batch_size):
+                _, chunks = self._ingest_batch(batch)
+                merged = sum(c["merged"] for c in chunks)
+                report["pairs"] += len(batch)
+                report["chunks_merged"] += merged
+                report["chunks_new"] += len(chunks) - merged
+                batch = []
+        self.vindex.save()
+        elapsed = time.perf_counter() - start
+        report["seconds"] = elapsed
+        report["pairs_per_sec"] = report["pairs"] / elapsed if elapsed > 0 else 0.0
+        return report
+
+    def _ingest_batch(self, pairs: List[Tuple[str, str]]) -> Tuple[List[int], List[dict]]:
+        try:
+            with self.store.batch():
+                return self._ingest(pairs)
+        except Exception:
+            # drop index entries and cached state the rollback invalidated
+            self._hot = (-1, None, None)
+            self.vindex.sync(self.store)
+            raise
+
+    def _ingest(self, pairs: List[Tuple[str, str]]) -> Tuple[List[int], List[dict]]:
+        # append raw turns and fold DL signals in, then trim the ledger once
+        new_turns, turn_ids = [], []
+        for user_msg, assistant_msg in pairs:
+            user_turn = Turn(role="user", text=user_msg)
+            assistant_turn = Turn(role="assistant", text=assistant_msg)
+            self.store.append_turn(user_turn)
+            turn_ids.append(self.store.append_turn(assistant_turn))
+            new_turns += [user_turn, assistant_turn]
+            self.store.merge_ledger(extractors.extract_dl_signals(user_msg))
+            self.store.merge_ledger(extractors.extract_dl_signals(assistant_msg))
+        self.store.trim_ledger(self.dl_cap_tokens)
+        # update AC (a new list, so a rollback leaves the hot state untouched)
+        hot_ac, _ = self._hot_state()
+        ac = (hot_ac + new_turns)[-self.ac_pairs*2:]
         self.store.save_ac(ac)
-        # decision ledger
-        dl = self.store.load_ledger()
-        delta_user = extractors.extract_dl_signals(user_msg)
-        delta_assistant = extractors.extract_dl_signals(assistant_msg)
-        for field in ["decisions","constraints","todos","prefs"]:
-            setattr(dl, field, getattr(dl, field) + getattr(delta_user, field) + getattr(delta_assistant, field))
-        dl.ids.update(delta_user.ids)
-        dl.ids.update(delta_assistant.ids)
-        # cap DL tokens by trimming lists
-        def dl_tokens(d: DecisionLedger) -> int:
-            return len_tokens(yaml.dump(d.model_dump()))
-        while dl_tokens(dl) > self.dl_cap_tokens:
-            trimmed = False
-            for field in ["decisions","constraints","todos","prefs"]:
-                lst = getattr(dl, field)
-                if lst:
-                    lst.pop(0)
-                    trimmed = True
-                    if dl_tokens(dl) <= self.dl_cap_tokens:
-                        break
-            if not trimmed:
-                break
-        self.store.save_ledger(dl)
-        # summaries
-        ext = extractors.make_extractive(user_msg, assistant_msg, self.es_tokens)
-        abs_s = extractors.make_abstractive(user_msg, assistant_msg, self.es_tokens)
-        vecs = self.embedder.encode([ext, abs_s])
-        fs_chunks = self.store.load_fs_chunks()
-        for text, typ, vec in zip([ext, abs_s], ["extractive","abstractive"], vecs):
-            new_chunk = FSChunk(id=str(uuid.uuid4()), type=typ, tags=[], text=text, src_turn=turn_id, vec=vec)
-            duplicate = None
-            for ch in fs_chunks:
-                if ch.vec is None:
-                    continue
-                sim = float(ch.vec @ vec)
-                if sim > 0.9:
-                    duplicate = ch
-                    break
-            if duplicate:
-                merged = reducers.densify(duplicate.text, text, self.es_tokens)
-                duplicate.text = merged
-                duplicate.vec = (duplicate.vec + vec) / 2
-                self.store.upsert_fs_chunk(duplicate)
+        self._hot = (self.store.state_version(), ac, self.store.load_ledger())
+        # summaries, embedded in one call
+        texts, types, src, tags = [], [], [], []
+        for (user_msg, assistant_msg), turn_id in zip(pairs, turn_ids):
+            texts += [extractors.make_extractive(user_msg, assistant_msg, self.es_tokens),
+                      extractors.make_abstractive(user_msg, assistant_msg, self.es_tokens)]
+            types += ["extractive", "abstractive"]
+            src += [turn_id, turn_id]
+            tags += [extractors.extract_tags(f"{user_msg}\n{assistant_msg}")] * 2
+        vecs = self.embedder.encode(texts)
+        # dedup: one batched top-1 query against the index, plus similarities within the batch
+        hits = self.vindex.search_many(vecs, 1)
+        dup_ids = [h[0][0] for h in hits if h and h[0][1] > self.dedup_threshold]
+        touched: Dict[str, FSChunk] = {c.id: c for c in self.store.get_fs_chunks(list(dict.fromkeys(dup_ids)))}
+        intra = vecs @ vecs.T
+        assigned: List[FSChunk] = []
+        chunks = []
+        for i, (text, typ, vec) in enumerate(zip(texts, types, vecs)):
+            sim = hits[i][0][1] if hits[i] else 0.0
+            target = touched.get(hits[i][0][0]) if sim > self.dedup_threshold else None
+            if i:
+                j = int(np.argmax(intra[i, :i]))
+                if intra[i, j] > max(self.dedup_threshold, sim if target is not None else 0.0):
+                    target, sim = assigned[j], float(intra[i, j])
+            merged = target is not None
+            if merged:
+                target.text = reducers.densify(target.text, text, self.es_tokens)
+                target.vec = _normalize(target.vec + vec)
+                target.tags = list(dict.fromkeys(target.tags + tags[i]))
+                self._note_hits([target.id])
             else:
-                self.store.upsert_fs_chunk(new_chunk)
-                fs_chunks.append(new_chunk)
+                target = FSChunk(id=str(uuid.uuid4()), type=typ, tags=tags[i], text=text, src_turn=src[i], vec=vec)
+            assigned.append(target)
+            chunks.append({"id": target.id, "type": typ, "merged": merged, "similarity": sim})
+        changed = list({c.id: c for c in assigned}.values())
+        self.store.upsert_fs_chunks(changed)
+        self._flush_hits()
+        self._flush_embeddings()
+        self.vindex.add_many([c.id for c in changed], np.vstack([c.vec for c in changed]))
+        if self.vindex.stale > max(1024, len(self.vindex)):
+            self.vindex.rebuild((c.id, c.vec) for c in self.store.load_fs_chunks())
+        else:
+            self.vindex.maybe_save()
+        return turn_ids, chunks
 
     # -------- Compose phase ---------
-    def compose_context(self, next_user_msg: str) -> str:
-        ac = self.store.load_ac()
-        ac_text_lines = [f"{t.role}: {t.text}" for t in ac]
-        ac_text = "\n".join(ac_text_lines)
-        ac_text = cap_to_tokens(ac_text, 400)
-        dl = self.store.load_ledger()
-        dl_yaml = yaml.dump(dl.model_dump())
-        dl_yaml = cap_to_tokens(dl_yaml, self.dl_cap_tokens)
-        base = ac_text + "\n" + dl_yaml
-        used = len_tokens(base)
-        remaining = max(0, self.budget_tokens - used)
-        fs_chunks = self.store.load_fs_chunks()
-        retrieved = retrieval.hybrid_search(next_user_msg, dl, fs_chunks, self.embedder, k=5)
-        snippets = [c.text for c in retrieved]
-        cond = reducers.condenser(snippets, remaining)
-        context = base + "\n" + cond
+    def compose_context(self, next_user_msg: str, tags: Optional[List[str]] = None) -> str:
+        """Context for ``next_user_msg``; memoized until the store changes.
+
+        ``tags`` limits retrieved chunks to those carrying any of them (AC and DL are unaffected).
+        """
+        query = " ".join(next_user_msg.split())
+        scope = None if tags is None else tuple(sorted(set(tags)))
+        key = (query, scope, self.store.versions(), self.budget_tokens, self.dl_cap_tokens, self.pack)
+        with self._compose_lock:
+            cached = self._compose_cache.get(key)
+            if cached is not None:
+                self._compose_cache.move_to_end(key)
+                self.compose_hits += 1
+                return cached
+        context = self._compose(query, tags)
+        with self._compose_lock:
+            self.compose_misses += 1
+            if self.compose_cache_size > 0:
+                self._compose_cache[key] = context
+                while len(self._compose_cache) > self.compose_cache_size:
+                    self._compose_cache.popitem(last=False)
+        return context
+
+    def _compose(self, next_user_msg: str, tags: Optional[List[str]] = None) -> str:
+        if self.pack:
+            context = self._compose_packed(next_user_msg, tags)
+        else:
+            context = "\n".join(self.compose_stream(next_user_msg, tags))
         if len_tokens(context) > self.budget_tokens:
             context = reducers.final_budget_cut(context, self.budget_tokens)
         return context
 
+    def compose_stream(self, next_user_msg: str, tags: Optional[List[str]] = None) -> Iterator[str]:
+        """Yield context sections in priority order: AC, DL, then retrieved chunks best first.
+
+        Each section is capped to the budget left (counting one token for the newline that
+        joins it to the previous one), and the stream ends once ``budget_tokens`` is spent,
+        so retrieval only runs when AC and DL leave room. ``"\n".join`` of the sections is
+        what ``compose_context`` returns when packing is off.
+        """
+        remaining = self.budget_tokens
+        first = True
+        for text in self._sections(next_user_msg, tags):
+            if not text:
+                continue
+            cost = len_tokens(text) + (not first)
+            if cost > remaining:
+                text = cap_to_tokens(text, remaining - (not first))
+                if text:
+                    yield text
+                return
+            remaining -= cost
+            first = False
+            yield text
+            if remaining <= 1:
+                return
+
+    def _sections(self, next_user_msg: str, tags: Optional[List[str]] = None) -> Iterator[str]:
+        # lazy: the consumer stops pulling once the budget is spent
+        ac, dl = self._hot_state()
+        yield cap_to_tokens("\n".join(f"{t.role}: {t.text}" for t in ac), 400)
+        yield cap_to_tokens(yaml.dump(dl.model_dump()), self.dl_cap_tokens)
+        query = " ".join(next_user_msg.split())
+        chunks = retrieval.hybrid_search(query, dl, None, self.embedder, k=5, store=self.store, vindex=self.vindex,
+                                         tags=tags)
+        self._note_hits(c.id for c in chunks)
+        for chunk in chunks:
+            yield chunk.text
+
+    def pack_items(self, next_user_msg: str, n_chunks: int = 12,
+                   tags: Optional[List[str]] = None) -> List[packer.PackItem]:
+        """Every candidate unit for the context, valued by prior plus similarity to the query."""
+        ac, dl = self._hot_state()
+        items: List[packer.PackItem] = []
+        for i, turn in enumerate(ac):
+            text = cap_to_tokens(f"{turn.role}: {turn.text}", 400)
+            prior = packer.TURN_PRIOR * packer.TURN_DECAY ** (len(ac) - 1 - i)
+            items.append(packer.PackItem("turn", text, len_tokens(text) + 1, prior, ref=i))
+        for field, key, value, tokens, hits in self.store.ledger_entries():
+            prior = packer.LEDGER_PRIOR[field] * (1 + 0.25 * math.log(hits))
+            text = f"{key}: {value}" if field == "ids" else value
+            items.append(packer.PackItem("ledger", text, tokens, prior, ref=(field, key, value)))
+        chunks = retrieval.hybrid_search(next_user_msg, dl, None, self.embedder, k=n_chunks,
+                                         store=self.store, vindex=self.vindex, tags=tags)
+        self._note_hits(c.id for c in chunks)
+        for rank, chunk in enumerate(chunks):
+            items.append(packer.PackItem("chunk", chunk.text, len_tokens(chunk.text) + 1,
+                                         packer.CHUNK_PRIOR / (1 + 0.25 * rank), ref=chunk))
+        if items:
+            q_vec = self.embedder.encode([next_user_msg])[0]
+            texts = [it.text for it in items if it.kind != "chunk"]
+            vecs = [self.embedder.encode(texts)] if texts else []
+            vecs += [np.vstack([c.vec for c in chunks])] if chunks else []
+            sims = np.vstack(vecs) @ q_vec
+            for it, sim in zip(items, sims):
+                it.value += max(0.0, float(sim))
+        return items
+
+    def _compose_packed(self, next_user_msg: str, tags: Optional[List[str]] = None) -> str:
+        items = self.pack_items(next_user_msg, tags=tags)
+        budget = self.budget_tokens
+        if any(it.kind == "ledger" for it in items):
+            # the YAML skeleton is paid once if any entry goes in
+            budget -= len_tokens(yaml.dump(DecisionLedger().model_dump()))
+        chosen = [items[i] for i in packer.pack(items, budget)]
+        turns = [it.text for it in chosen if it.kind == "turn"]
+        entries = [it.ref for it in chosen if it.kind == "ledger"]
+        sections = ["\n".join(turns)]
+        if entries:
+            dl = DecisionLedger()
+            for field, key, value in entries:
+                if field == "ids":
+                    dl.ids[key] = value
+                else:
+                    getattr(dl, field).append(value)
+            sections.append(yaml.dump({f: v for f, v in dl.model_dump().items() if v}))
+        sections += [it.text for it in chosen if it.kind == "chunk"]
+        return "\n".join(s for s in sections if s)
+
+    # -------- Compaction ---------
+    def _note_hits(self, chunk_ids: Iterable[str]) -> None:
+        with self._hits_lock:
+            self._pending_hits.update(chunk_ids)
+
+    def _flush_hits(self) -> None:
+        with self._hits_lock:
+            hits, self._pending_hits = self._pending_hits, Counter()
+        if hits:
+            self.store.record_hits(hits)
+
+    def _flush_embeddings(self) -> None:
+        if isinstance(self.embedder, CachedEmbedder):
+            self.embedder.flush()
+
+    def compact(self, threshold: float = None, max_age_days: float = 30.0, min_hits: int = 1,
+                max_chunks: int = None) -> dict:
+        """Merge near-duplicate chunks, evict stale ones and compact both indexes.
+
+        Chunks are visited by hits, then recency; each one not yet claimed claims its
+        unclaimed neighbours above ``threshold`` cosine (default ``dedup_threshold``), and they
+        are folded into it with ``densify`` and a re-normalized mean vector. Chunks older than
+        ``max_age_days`` with fewer than ``min_hits`` hits are evicted, and beyond
+        ``max_chunks`` the lowest ``(1 + hits) * 0.5 ** (age / max_age_days)`` go too.
+        """
+        start = time.perf_counter()
+        threshold = self.dedup_threshold if threshold is None else threshold
+        now = time.time()
+        report = {"chunks_before": 0, "clusters": 0, "merged": 0, "renormalized": 0, "evicted": 0}
+        with self.store.batch():
+            self._flush_hits()
+            chunks = [c for c in self.store.load_fs_chunks() if c.vec is not None]
+            stats = self.store.chunk_stats()
+            report["chunks_before"] = len(stats)
+            changed: Dict[int, FSChunk] = {}
+            merged_stats: Dict[str, tuple] = {}
+            dropped: List[str] = []
+            if chunks:
+                vecs = np.vstack([c.vec for c in chunks]).astype(np.float32)
+                norms = np.linalg.norm(vecs, axis=1)
+                unit = vecs / np.maximum(norms, 1e-12)[:, None]
+                pos = {c.id: i for i, c in enumerate(chunks)}
+                order = sorted(range(len(chunks)), key=lambda i: (-stats[chunks[i].id][0], -stats[chunks[i].id][1]))
+                owner: Dict[int, int] = {}
+                for lo in range(0, len(order), 256):
+                    block = order[lo:lo + 256]
+                    for i, found in zip(block, self.vindex.search_many(unit[block], 8)):
+                        if i in owner:
+                            continue
+                        owner[i] = i
+                        for cid, score in found:
+                            j = pos.get(cid)
+                            # the index scores against the stored vector, which may not be unit length
+                            if j is not None and j not in owner and score / max(norms[j], 1e-12) > threshold:
+                                owner[j] = i
+                groups: Dict[int, List[int]] = {}
+                for j, i in owner.items():
+                    if j != i:
+                        groups.setdefault(i, []).append(j)
+                for i, members in groups.items():
+                    lead = chunks[i]
+                    for j in members:
+                        lead.text = reducers.densify(lead.text, chunks[j].text, self.es_tokens)
+                        lead.tags = list(dict.fromkeys(lead.tags + chunks[j].tags))
+                    unit[i] = _normalize(unit[[i] + members].sum(axis=0))
+                    ids = [lead.id] + [chunks[j].id for j in members]
+                    merged_stats[lead.id] = (sum(stats[c][0] for c in ids), max(stats[c][1] for c in ids))
+                    dropped += ids[1:]
+                    changed[i] = lead
+                skewed = np.flatnonzero(np.abs(norms - 1.0) > quantize.NORM_TOLERANCE[self.store.vec_dtype])
+                for i in skewed:
+                    changed.setdefault(int(i), chunks[i])
+                for i, chunk in changed.items():
+                    chunk.vec = unit[i]
+                report.update(clusters=len(groups), merged=len(dropped), renormalized=len(skewed))
+            stats.update(merged_stats)
+            gone = set(dropped)
+            alive = [cid for cid in stats if cid not in gone]
+            age = {cid: max(0.0, now - stats[cid][1]) / 86400 for cid in alive}
+            evict = {cid for cid in alive if age[cid] > max_age_days and stats[cid][0] < min_hits}
+            alive = [cid for cid in alive if cid not in evict]
+            if max_chunks is not None and len(alive) > max_chunks:
+                worth = {cid: (1 + stats[cid][0]) * 0.5 ** (age[cid] / max_age_days) for cid in alive}
+                evict.update(sorted(alive, key=worth.get)[:len(alive) - max_chunks])
+            report["evicted"] = len(evict)
+            self.store.upsert_fs_chunks([c for c in changed.values() if c.id not in evict])
+            self.store.set_chunk_stats({cid: s for cid, s in merged_stats.items() if cid not in evict})
+            self.store.delete_fs_chunks(dropped + sorted(evict))
+        # still the only writer: an ingest's add_many between the reload and the rebuild would be lost
+        with self.store.exclusive():
+            report["vec_rows_dropped"] = self.store.compact_vectors()
+            self.vindex.rebuild((c.id, c.vec) for c in self.store.load_fs_chunks())
+        report["chunks_after"] = self.store.count_fs()
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+    def start_compactor(self, interval: float = 3600.0, **options) -> threading.Thread:
+        """Run ``compact(**options)`` every ``interval`` seconds on a daemon thread until ``close()``."""
+        def run():
+            while not self._compactor_stop.wait(interval):
+                try:
+                    log.info("compaction: %s", self.compact(**options))
+                except Exception:
+                    log.exception("background compaction failed")
+        self._compactor_stop.clear()
+        self._compactor = threading.Thread(target=run, name="context-engine-compactor", daemon=True)
+        self._compactor.start()
+        return self._compactor
+
+    def close(self) -> None:
+        """Stop the compactor, then persist the vector index and commit any write-behind backlog."""
+        if self._compactor is not None:
+            self._compactor_stop.set()
+            self._compactor.join()
+            self._compactor = None
+        self._flush_hits()
+        self._flush_embeddings()
+        self.vindex.save()
+        self.store.close()
+
     def stats(self) -> dict:
-        ac = self.store.load_ac()
-        dl = self.store.load_ledger()
+        ac, _ = self._hot_state()
         fs_count = self.store.count_fs()
-        return {
+        stats = {
             "ac_pairs": len(ac)//2,
-            "dl_tokens": len_tokens(yaml.dump(dl.model_dump())),
+            "dl_tokens": self.store.ledger_tokens(),
             "fs_chunks": fs_count,
         }
+        if isinstance(self.embedder, CachedEmbedder):
+            stats["embedding_cache"] = self.embedder.stats()
+        stats["compose_cache"] = {"hits": self.compose_hits, "misses": self.compose_misses,
+                                  "size": len(self._compose_cache)}
+        stats["vectors"] = self.store.vector_stats()
+        return stats
+
+    def quantization_recall(self, k: int = 10, sample: int = 256, dtype: Optional[str] = None, seed: int = 0) -> dict:
+        """Estimate what quantizing to ``dtype`` (default: the store's) costs retrieval in this session.
+
+        Re-embeds the text of up to ``sample`` random chunks at full precision and reports
+        recall@k of scoring them quantized against float32, via ``quantize.recall``.
+        """
+        dtype = quantize.check(dtype or self.store.vec_dtype)
+        chunks = self.store.load_fs_chunks()
+        picks = np.random.default_rng(seed).permutation(len(chunks))[:sample]
+        originals = self.embedder.encode([chunks[i].text for i in picks]) if len(picks) else np.zeros((0, 1))
+        return dict(quantize.recall(originals, dtype, k), dtype=dtype)
@@ -28,6 +28,14 @@ def extract_dl_signals(text: str) -> DecisionLedger:
                 dl.ids[parts[0].strip()] = parts[1].strip()
     return dl
 
+_path_re = re.compile(r"(?<![\w/.-])(?:[\w.-]+/)+[\w.-]*\w|\b[\w-]+\.(?:py|ts|tsx|js|jsx|go|rs|java|rb|md|css|html|astro|tf|json|ya?ml|toml|sql)\b")
+_hashtag_re = re.compile(r"(?<![\w&])#([A-Za-z][\w-]*)")
+
+def extract_tags(text: str) -> List[str]:
+    """File paths and ``#topic`` hashtags mentioned in ``text``, lowercased, first mention first."""
+    tags = [m.group(0) for m in _path_re.finditer(text)] + [m.group(1) for m in _hashtag_re.finditer(text)]
+    return list(dict.fromkeys(t.lower() for t in tags))
+
 # Optional stub for LLM extraction
 def llm_extract_signals(text: str) -> DecisionLedger:  # pragma: no cover - placeholder
     return extract_dl_signals(text)
@@ -0,0 +1,33 @@
+"""Readers that stream (user, assistant) pairs from saved transcripts."""
+from __future__ import annotations
+from typing import Iterator, Tuple
+import json
+
+def _pair(item: dict):
+    # codex-assist history.json uses prompt/response; JSONL exports may use user/assistant
+    user = item.get("user", item.get("prompt"))
+    assistant = item.get("assistant", item.get("response"))
+    if isinstance(user, str) and isinstance(assistant, str):
+        return user, assistant
+    return None
+
+def iter_pairs(path: str) -> Iterator[Tuple[str, str]]:
+    """Yield pairs from a ``history.json`` list or a JSONL file, skipping malformed entries."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    pair = _pair(json.loads(line))
+                except (json.JSONDecodeError, AttributeError):
+                    continue
+                if pair:
+                    yield pair
+            return
+        data = json.load(f)
+    for item in data if isinstance(data, list) else []:
+        pair = _pair(item) if isinstance(item, dict) else None
+        if pair:
+            yield pair
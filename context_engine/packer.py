@@ -0,0 +1,73 @@
+"""Budget packing: pick the context units worth the most per token (0/1 knapsack)."""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, List
+import numpy as np
+
+# exact DP while items x budget stays below this; greedy by value density beyond it
+EXACT_CELLS = 4_000_000
+
+# priors added to query similarity: recent turns and hard constraints matter most
+TURN_PRIOR = 1.0
+TURN_DECAY = 0.7
+LEDGER_PRIOR = {"constraints": 0.9, "decisions": 0.8, "ids": 0.7, "todos": 0.6, "prefs": 0.5}
+CHUNK_PRIOR = 0.5
+
+
+@dataclass
+class PackItem:
+    kind: str  # "turn", "ledger" or "chunk"
+    text: str
+    tokens: int
+    value: float
+    ref: Any = None
+
+
+def pack(items: List[PackItem], budget: int) -> List[int]:
+    """Indices (ascending) of the ``items`` with the most total value within ``budget`` tokens.
+
+    Solved exactly by dynamic programming over token counts, one numpy pass per item,
+    while ``len(items) * budget`` is small; larger inputs fall back to greedy by value per
+    token, which is never worse than the single most valuable item that fits.
+    """
+    budget = max(0, int(budget))
+    costs = np.array([max(0, it.tokens) for it in items], dtype=np.int64)
+    values = np.array([it.value for it in items], dtype=np.float64)
+    if not items:
+        return []
+    if len(items) * (budget + 1) <= EXACT_CELLS:
+        return _pack_exact(costs, values, budget)
+    return _pack_greedy(costs, values, budget)
+
+
+def _pack_exact(costs: np.ndarray, values: np.ndarray, budget: int) -> List[int]:
+    best = np.zeros(budget + 1)
+    take = np.zeros((len(costs), budget + 1), dtype=bool)
+    for i, (cost, value) in enumerate(zip(costs, values)):
+        if cost > budget or value <= 0:
+            continue
+        with_item = np.full(budget + 1, -np.inf)
+        with_item[cost:] = best[:budget + 1 - cost] + value
+        take[i] = with_item > best
+        best = np.where(take[i], with_item, best)
+    chosen, left = [], int(np.argmax(best))
+    for i in range(len(costs) - 1, -1, -1):
+        if take[i, left]:
+            chosen.append(i)
+            left -= int(costs[i])
+    return sorted(chosen)
+
+
+def _pack_greedy(costs: np.ndarray, values: np.ndarray, budget: int) -> List[int]:
+    order = np.argsort(-values / np.maximum(costs, 1), kind="stable")
+    chosen, left = [], budget
+    for i in order:
+        if values[i] > 0 and costs[i] <= left:
+            chosen.append(int(i))
+            left -= int(costs[i])
+    fits = np.flatnonzero((costs <= budget) & (values > 0))
+    if len(fits):
+        single = int(fits[np.argmax(values[fits])])
+        if values[single] > values[chosen].sum():
+            chosen = [single]
+    return sorted(chosen)
@@ -0,0 +1,88 @@
+"""Scalar quantization of FS chunk vectors: float16, or int8 with one scale per vector."""
+from __future__ import annotations
+import numpy as np
+
+DTYPES = ("float32", "float16", "int8")
+
+# file suffix per dtype; float32 keeps the name files had before quantization existed
+SUFFIX = {"float32": "f32", "float16": "f16", "int8": "i8"}
+
+# how far off unit length a stored vector may be before compaction re-normalizes it
+NORM_TOLERANCE = {"float32": 1e-3, "float16": 1e-3, "int8": 1e-2}
+
+# rows dequantized at a time when scoring, bounding the float32 scratch space
+BLOCK = 8192
+
+
+def check(kind: str) -> str:
+    if kind not in DTYPES:
+        raise ValueError(f"unknown vector dtype {kind!r}; expected one of {', '.join(DTYPES)}")
+    return kind
+
+
+def row_dtype(kind: str, dim: int) -> np.dtype:
+    """numpy dtype of one stored row; int8 rows carry their float32 scale after the codes."""
+    if kind == "int8":
+        return np.dtype([("q", np.int8, (dim,)), ("scale", np.float32)])
+    return np.dtype(kind)
+
+
+def row_shape(kind: str, n: int, dim: int) -> tuple:
+    return (n,) if kind == "int8" else (n, dim)
+
+
+def row_bytes(kind: str, dim: int) -> int:
+    return row_dtype(kind, dim).itemsize * (1 if kind == "int8" else dim)
+
+
+def encode(vecs: np.ndarray, kind: str) -> np.ndarray:
+    """float32 vectors (n, dim) -> stored rows."""
+    vecs = np.asarray(vecs, dtype=np.float32)
+    if kind != "int8":
+        return vecs.astype(kind)
+    scale = np.abs(vecs).max(axis=1) / 127
+    scale[scale == 0] = 1.0
+    rows = np.empty(len(vecs), dtype=row_dtype(kind, vecs.shape[1]))
+    rows["q"] = np.clip(np.rint(vecs / scale[:, None]), -127, 127)
+    rows["scale"] = scale
+    return rows
+
+
+def decode(rows: np.ndarray, kind: str) -> np.ndarray:
+    """Stored rows -> float32 vectors (n, dim)."""
+    if kind == "int8":
+        return rows["q"].astype(np.float32) * rows["scale"][:, None]
+    return np.asarray(rows, dtype=np.float32)
+
+
+def scores(rows: np.ndarray, q_vecs: np.ndarray, kind: str) -> np.ndarray:
+    """Inner products (m, n) of float32 queries with stored rows, dequantizing a block at a time."""
+    q = np.asarray(q_vecs, dtype=np.float32).reshape(-1, q_vecs.shape[-1])
+    if kind == "float32":
+        return q @ rows.T
+    out = np.empty((len(q), len(rows)), dtype=np.float32)
+    for i in range(0, len(rows), BLOCK):
+        out[:, i:i + BLOCK] = q @ decode(rows[i:i + BLOCK], kind).T
+    return out
+
+
+def recall(originals: np.ndarray, kind: str, k: int = 10) -> dict:
+    """Recall@k of scoring quantized ``originals`` against scoring them at full precision.
+
+    Every vector queries all the others (itself excluded), as a compose query would
+    query the store. Also reports the mean cosine between each vector and its round trip.
+    """
+    f = np.asarray(originals, dtype=np.float32)
+    n = len(f)
+    k = min(k, n - 1)
+    if k <= 0:
+        return {"sample": n, "k": k, "recall_at_k": None, "mean_cosine": None}
+    back = decode(encode(f, kind), kind)
+    cos = np.sum(f * back, axis=1) / np.maximum(np.linalg.norm(f, axis=1) * np.linalg.norm(back, axis=1), 1e-12)
+    exact, approx = f @ f.T, f @ back.T
+    np.fill_diagonal(exact, -np.inf)
+    np.fill_diagonal(approx, -np.inf)
+    top_exact = np.argpartition(-exact, k - 1, axis=1)[:, :k]
+    top_approx = np.argpartition(-approx, k - 1, axis=1)[:, :k]
+    hit = [len(set(a) & set(b)) for a, b in zip(top_exact, top_approx)]
+    return {"sample": n, "k": k, "recall_at_k": float(np.sum(hit)) / (n * k), "mean_cosine": float(cos.mean())}
@@ -1,53 +1,92 @@
 """Hybrid retrieval and MMR."""
 from __future__ import annotations
-from typing import List
+from typing import TYPE_CHECKING, List, Optional
 import numpy as np
-from rank_bm25 import BM25Okapi
 from .models import DecisionLedger, FSChunk
+from . import bm25
 
+if TYPE_CHECKING:  # pragma: no cover
+    from .store import Store
+    from .vector_index import VectorIndex
 
-def _tokenize(text: str) -> List[str]:
-    return text.lower().split()
 
-def hybrid_search(query: str, dl: DecisionLedger, fs_chunks: List[FSChunk], embedder, k: int = 8, mmr_lambda: float = 0.7) -> List[FSChunk]:
-    if not fs_chunks:
-        return []
-    # build corpus
-    corpus = [f"{c.text} {' '.join(c.tags)}" for c in fs_chunks]
-    tokenized_corpus = [_tokenize(c) for c in corpus]
-    bm25 = BM25Okapi(tokenized_corpus)
+def hybrid_search(query: str, dl: DecisionLedger, fs_chunks: Optional[List[FSChunk]], embedder, k: int = 8,
+                  mmr_lambda: float = 0.7, store: Optional[Store] = None, vindex: Optional[VectorIndex] = None,
+                  n_candidates: int = 64, tags: Optional[List[str]] = None) -> List[FSChunk]:
+    """Fuse BM25 and cosine ranks with RRF, then diversify with MMR.
+
+    With a ``store`` the BM25 side reads the persistent inverted index; otherwise a
+    throwaway in-memory index is built over ``fs_chunks``. With a ``vindex`` as well,
+    ``fs_chunks`` is ignored: only the top ``n_candidates`` of each ranker are loaded
+    from the store and rescored exactly. MMR only considers the top ``n_candidates``
+    fused results.
+
+    ``tags`` restricts retrieval to chunks carrying any of them. With a ``store`` the
+    subset comes from its tag index and only the subset's postings and vectors are
+    scored, so a scoped query costs in proportion to the subset rather than the session.
+    """
     q_extra = " ".join(list(dl.ids.values()) + dl.decisions + dl.todos + dl.constraints)
     full_query = f"{query} {q_extra}".strip()
-    bm25_scores = bm25.get_scores(_tokenize(full_query))
+    q_terms = bm25.tokenize(full_query)
+    q_vec = None
+    if tags is not None and store is not None:
+        q_vec = embedder.encode([full_query])[0]
+        by_id = store.bm25_scores(q_terms, tags=tags)
+        ids, vecs = store.vectors(store.tagged_chunk_ids(tags))
+        top_text = sorted(by_id, key=by_id.get, reverse=True)[:n_candidates]
+        top_vec = [ids[i] for i in np.argsort(-(vecs @ q_vec))[:n_candidates]] if ids else []
+        fs_chunks = store.get_fs_chunks(list(dict.fromkeys(top_text + top_vec)))
+    elif vindex is not None and store is not None:
+        q_vec = embedder.encode([full_query])[0]
+        by_id = store.bm25_scores(q_terms)
+        top_text = sorted(by_id, key=by_id.get, reverse=True)[:n_candidates]
+        top_vec = [cid for cid, _ in vindex.search(q_vec, n_candidates)]
+        fs_chunks = store.get_fs_chunks(list(dict.fromkeys(top_text + top_vec)))
+    elif fs_chunks:
+        if tags is not None:
+            fs_chunks = [c for c in fs_chunks if set(c.tags) & set(tags)]
+        index = store if store is not None else bm25.MemoryIndex({c.id: bm25.doc_text(c.text, c.tags) for c in fs_chunks})
+        by_id = index.bm25_scores(q_terms)
+    if not fs_chunks:
+        return []
+    bm25_scores = np.array([by_id.get(c.id, 0.0) for c in fs_chunks])
     # embeddings
     texts = [c.text for c in fs_chunks]
     chunk_vecs = np.vstack([c.vec for c in fs_chunks]) if fs_chunks[0].vec is not None else embedder.encode(texts)
     for c, v in zip(fs_chunks, chunk_vecs):
         c.vec = v
-    q_vec = embedder.encode([full_query])[0]
+    if q_vec is None:
+        q_vec = embedder.encode([full_query])[0]
     cos_scores = chunk_vecs @ q_vec
     # ranks
     bm25_rank = np.argsort(np.argsort(-bm25_scores))
     cos_rank = np.argsort(np.argsort(-cos_scores))
     rrf = 1/(60 + bm25_rank) + 1/(60 + cos_rank)
-    order = np.argsort(-rrf)
-    # apply MMR
-    selected = []
-    selected_vecs = []
-    for idx in order:
-        candidate = fs_chunks[idx]
-        cand_vec = chunk_vecs[idx]
-        if not selected:
-            selected.append(candidate)
-            selected_vecs.append(cand_vec)
-        else:
-            sims = [cand_vec @ v for v in selected_vecs]
-            max_sim = max(sims)
-            mmr_score = mmr_lambda * (cand_vec @ q_vec) - (1 - mmr_lambda) * max_sim
-            if mmr_score <= 0:
-                continue
-            selected.append(candidate)
-            selected_vecs.append(cand_vec)
-        if len(selected) >= k:
+    order = np.argsort(-rrf)[:n_candidates]
+    picks = mmr_select(q_vec, chunk_vecs[order], k, mmr_lambda)
+    return [fs_chunks[order[i]] for i in picks]
+
+
+def mmr_select(q_vec: np.ndarray, cand_vecs: np.ndarray, k: int, mmr_lambda: float = 0.7) -> List[int]:
+    """Greedy MMR over ``cand_vecs`` given in fused-rank order; returns selected row positions.
+
+    Walks the ranking and keeps a candidate when ``lambda*rel - (1-lambda)*max_sim > 0``.
+    ``max_sim`` only grows, so a rejected candidate stays rejected and each selection is
+    one matrix-vector product plus a scan for the next passing row.
+    """
+    n = len(cand_vecs)
+    if n == 0 or k <= 0:
+        return []
+    rel = mmr_lambda * (cand_vecs @ q_vec)
+    max_sim = cand_vecs @ cand_vecs[0]
+    selected = [0]
+    start = 1
+    while len(selected) < k and start < n:
+        passing = np.flatnonzero(rel[start:] - (1 - mmr_lambda) * max_sim[start:] > 0)
+        if passing.size == 0:
             break
+        i = start + int(passing[0])
+        selected.append(i)
+        max_sim = np.maximum(max_sim, cand_vecs @ cand_vecs[i])
+        start = i + 1
     return selected
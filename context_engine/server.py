@@ -0,0 +1,216 @@
+"""Long-running JSON API over HTTP/1.1 (TCP or Unix socket) that keeps engines warm."""
+from __future__ import annotations
+import asyncio
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from .engine import ContextEngine
+
+MAX_BODY = 16 * 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class EnginePool:
+    """One warm ContextEngine per session, least recently used closed beyond ``max_engines``.
+
+    Engines are created and closed on the executor; an engine with requests in flight is
+    never closed.
+    """
+    def __init__(self, factory: Callable[[str], ContextEngine], executor: ThreadPoolExecutor, max_engines: int = 64):
+        self.factory = factory
+        self.executor = executor
+        self.max_engines = max_engines
+        self._engines: "OrderedDict[str, ContextEngine]" = OrderedDict()
+        self._busy: Dict[str, int] = {}
+        self._opening: Dict[str, asyncio.Future] = {}
+
+    async def acquire(self, session: str) -> ContextEngine:
+        """The session's engine, opened on first use; pair every call with ``release``."""
+        while session not in self._engines:
+            pending = self._opening.get(session)
+            if pending is None:
+                pending = self._opening[session] = asyncio.ensure_future(self._open(session))
+            # concurrent first requests for a session share one open
+            await asyncio.shield(pending)
+        self._engines.move_to_end(session)
+        self._busy[session] = self._busy.get(session, 0) + 1
+        return self._engines[session]
+
+    def release(self, session: str) -> None:
+        self._busy[session] -= 1
+        if not self._busy[session]:
+            del self._busy[session]
+
+    async def _open(self, session: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            self._engines[session] = await loop.run_in_executor(self.executor, self.factory, session)
+        finally:
+            del self._opening[session]
+        await self._evict(keep=session)
+
+    async def _evict(self, keep: str) -> None:
+        loop = asyncio.get_running_loop()
+        while len(self._engines) > self.max_engines:
+            # re-checked after every close: a session can be acquired while one is closing
+            idle = next((s for s in self._engines if s not in self._busy and s != keep), None)
+            if idle is None:
+                break
+            engine = self._engines.pop(idle)
+            await loop.run_in_executor(self.executor, engine.close)
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        engines = list(self._engines.values())
+        self._engines.clear()
+        for engine in engines:
+            await loop.run_in_executor(self.executor, engine.close)
+
+
+class ContextServer:
+    """Serves ``POST /ingest``, ``POST /compose`` and ``GET /stats``.
+
+    Request bodies are JSON objects; ``session`` selects the conversation (default
+    ``"default"``). Connections are kept alive, and engine work runs on a thread pool so
+    the event loop only parses and routes.
+    """
+    def __init__(self, db_path: str = "context.db", index_dir: str = "indexes", workers: int = 8,
+                 max_engines: int = 64, **engine_kwargs):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="context-engine")
+        self.pool = EnginePool(lambda session: ContextEngine(db_path, index_dir, session_id=session, **engine_kwargs),
+                               self.executor, max_engines=max_engines)
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765, unix_path: Optional[str] = None):
+        if unix_path:
+            self.server = await asyncio.start_unix_server(self._handle, path=unix_path)
+        else:
+            self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.pool.close()
+        self.executor.shutdown(wait=True)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                try:
+                    status, payload = 200, await self._dispatch(method, target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except Exception as e:  # pragma: no cover - surfaced to the client
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HTTPError as e:
+            self._write_response(writer, e.status, {"error": str(e)}, False)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, dict, bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPError(400, "bad Content-Length")
+        if length > MAX_BODY:
+            raise HTTPError(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    def _write_response(self, writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> dict:
+        url = urlsplit(target)
+        if url.path == "/stats":
+            if method != "GET":
+                raise HTTPError(405, "use GET")
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            return await self._call(params.get("session", "default"), lambda engine: engine.stats())
+        if url.path not in ("/ingest", "/compose"):
+            raise HTTPError(404, f"no route for {url.path}")
+        if method != "POST":
+            raise HTTPError(405, "use POST")
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "body must be a JSON object")
+        session = str(data.get("session", "default"))
+        if url.path == "/ingest":
+            user, assistant = data.get("user"), data.get("assistant")
+            if not isinstance(user, str) or not isinstance(assistant, str):
+                raise HTTPError(400, "ingest needs string fields 'user' and 'assistant'")
+            return await self._call(session, lambda engine: engine.update_memory(user, assistant))
+        query, tags = data.get("next"), data.get("tags")
+        if not isinstance(query, str):
+            raise HTTPError(400, "compose needs a string field 'next'")
+        if tags is not None and not (isinstance(tags, list) and all(isinstance(t, str) for t in tags)):
+            raise HTTPError(400, "'tags' must be a list of strings")
+        return await self._call(session, lambda engine: {"context": engine.compose_context(query, tags)})
+
+    async def _call(self, session: str, fn: Callable[[ContextEngine], dict]) -> dict:
+        engine = await self.pool.acquire(session)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, engine)
+        finally:
+            self.pool.release(session)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, unix_path: Optional[str] = None, **kwargs) -> None:
+    """Run a ContextServer until interrupted."""
+    async def main():
+        server = ContextServer(**kwargs)
+        srv = await server.start(host, port, unix_path)
+        where = unix_path or "{}:{}".format(*srv.sockets[0].getsockname()[:2])
+        print(f"context-engine serving on {where}", flush=True)
+        try:
+            await srv.serve_forever()
+        finally:
+            await server.close()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
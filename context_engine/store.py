@@ -1,97 +1,1003 @@
 from __future__ import annotations
 import sqlite3
+import functools
 import json
+import hashlib
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
 import numpy as np
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
 from .models import Turn, FSChunk, DecisionLedger
+from .tokens import len_tokens, len_tokens_many
+from . import bm25
+from . import quantize
 import yaml
 
+LEDGER_LISTS = ["decisions", "constraints", "todos", "prefs"]
+
+def _entry_yaml(field: str, key: str, value: str) -> str:
+    # the entry's share of the ledger's YAML rendering
+    if field == "ids":
+        return yaml.dump({key: value})
+    return yaml.dump([value])
+
+_OVERHEAD = None
+
+def _ledger_overhead() -> int:
+    global _OVERHEAD
+    if _OVERHEAD is None:
+        _OVERHEAD = len_tokens(yaml.dump(DecisionLedger().model_dump()))
+    return _OVERHEAD
+
+DEFAULT_SESSION = "default"
+
+def _session_slug(session_id: str) -> str:
+    # file-name-safe form of a session id for its vector files
+    if re.fullmatch(r"[A-Za-z0-9_-]{1,64}", session_id):
+        return session_id
+    return hashlib.blake2b(session_id.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _columns(c: sqlite3.Cursor, table: str) -> set:
+    return {r[1] for r in c.execute(f"PRAGMA table_info({table})")}
+
+def _writes(method):
+    # run as the single writer: under the write lock, on the writer connection
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._write():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _reads(method):
+    # write-behind writes waiting to commit exist only on the writer: read them there, under
+    # the write lock, so a read never lands in the middle of another thread's batch
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.write_behind > 0 and self._writer.in_transaction:
+            with self._write():
+                return method(self, *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def _rows_locked(method):
+    # the in-memory row map is shared by every thread's reads
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._rows_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class Store:
-    def __init__(self, db_path: str = "context.db"):
-        self.conn = sqlite3.connect(db_path)
-        self.conn.execute("PRAGMA journal_mode=WAL")
-        self._init_db()
+    """SQLite-backed memory; FS chunk vectors live in an append-only file.
+
+    The vector file ``<db stem>.vecs.f32`` sits in ``index_dir`` (relative paths resolve next
+    to the database) and is read through ``np.memmap``. ``vec_rows`` maps each chunk to its
+    current row; a re-embedded chunk appends a new row and its old one goes dead.
+
+    ``vec_dtype`` ("float16" or "int8", see ``quantize``) stores rows at 2 or 4x less than
+    float32 (``.vecs.f16``/``.vecs.i8``). It is a per-session setting; opening a session with
+    a different one converts its file. ``None`` keeps whatever the session already uses.
+
+    Writes commit immediately unless they run inside ``batch()``. With ``write_behind``
+    seconds > 0, commits are coalesced: pending writes are committed by the next write once
+    that long has passed since the last commit, by a background flush on the same interval,
+    and by ``flush()``/``close()``. While writes are pending, reads take the write lock and go
+    through the writer, so they see them and never see half of another thread's batch; reads
+    then wait for writes. The open transaction holds SQLite's write lock as well, so
+    write-behind suits single-writer, lightly threaded use.
+
+    A Store is bound to one ``session_id``: transcripts, AC, ledger, chunks, the text index
+    statistics and the vector file are all scoped to it, so many conversations can share
+    one database. The embedding cache is shared across sessions.
+
+    A Store can be shared between threads. Reads run on a per-thread connection, so they
+    proceed concurrently against the last committed WAL snapshot. Writes are serialized
+    through one writer connection under a lock; a thread holding it (inside ``batch()`` or
+    a write method) reads through the writer and sees its own uncommitted writes.
+    """
+    def __init__(self, db_path: str = "context.db", index_dir: str = "indexes", write_behind: float = 0.0,
+                 session_id: str = DEFAULT_SESSION, vec_dtype: Optional[str] = None):
+        if not os.path.isabs(index_dir):
+            index_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), index_dir)
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.session_id = session_id
+        self.name = os.path.splitext(os.path.basename(db_path))[0] or "context"
+        if session_id != DEFAULT_SESSION:
+            self.name += "." + _session_slug(session_id)
+        self.db_path = db_path
+        self.write_behind = write_behind
+        self._batch_depth = 0
+        self._last_commit = time.monotonic()
+        self._write_lock = threading.RLock()
+        self._writer_thread: Optional[int] = None
+        self._rows_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._writer = self._connect()
+        with self._write():
+            self._init_db()
+            if vec_dtype is not None and quantize.check(vec_dtype) != self.vec_dtype:
+                self.compact_vectors(vec_dtype)
+        self._closed = threading.Event()
+        if write_behind > 0:
+            threading.Thread(target=self._flush_loop, name="context-store-flush", daemon=True).start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread is off only so close() can close every thread's reader
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """This thread's connection: the writer while it holds the write lock, else its own reader."""
+        if self._writer_thread == threading.get_ident():
+            return self._writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._rows_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def _write(self):
+        with self._write_lock:
+            outer = self._writer_thread
+            self._writer_thread = threading.get_ident()
+            try:
+                yield
+            finally:
+                self._writer_thread = outer
 
     def _init_db(self) -> None:
         c = self.conn.cursor()
+        rebuild = self._migrate_sessions(c)
         c.execute("""CREATE TABLE IF NOT EXISTS transcripts(
                     turn_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    role TEXT, text TEXT, ts TEXT)""")
+                    role TEXT, text TEXT, ts TEXT, session_id TEXT NOT NULL DEFAULT 'default')""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_transcripts_session ON transcripts(session_id, turn_id)")
         c.execute("""CREATE TABLE IF NOT EXISTS fs_chunks(
                     id TEXT PRIMARY KEY,
-                    type TEXT, tags TEXT, text TEXT, src_turn INTEGER, vec BLOB)""")
+                    type TEXT, tags TEXT, text TEXT, src_turn INTEGER, vec BLOB,
+                    session_id TEXT NOT NULL DEFAULT 'default', hits INTEGER NOT NULL DEFAULT 0, created REAL)""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_fs_chunks_session ON fs_chunks(session_id)")
         c.execute("""CREATE TABLE IF NOT EXISTS ledger(
                     id INTEGER PRIMARY KEY, yaml TEXT)""")
+        # one row per ledger entry; list entries use the value itself as key
+        c.execute("""CREATE TABLE IF NOT EXISTS ledger_entries(
+                    session_id TEXT, field TEXT, key TEXT, value TEXT, token_count INTEGER,
+                    first_seen TEXT, hit_count INTEGER, seq INTEGER,
+                    PRIMARY KEY(session_id, field, key))""")
         c.execute("""CREATE TABLE IF NOT EXISTS meta(
                     key TEXT PRIMARY KEY, value TEXT)""")
-        # ensure ledger row
-        c.execute("INSERT OR IGNORE INTO ledger(id, yaml) VALUES(1, ?)" , (yaml.dump(DecisionLedger().model_dump()),))
-        c.execute("INSERT OR IGNORE INTO meta(key, value) VALUES('ac', '[]')")
+        # per-session AC, version counters, BM25 statistics and vector dim
+        c.execute("""CREATE TABLE IF NOT EXISTS sessions(
+                    session_id TEXT PRIMARY KEY, ac TEXT, state_version INTEGER, fs_version INTEGER,
+                    n_docs INTEGER, total_len INTEGER, vec_dim INTEGER, vec_epoch INTEGER NOT NULL DEFAULT 0,
+                    vec_dtype TEXT NOT NULL DEFAULT 'float32', vec_embedder TEXT)""")
+        # BM25 inverted index over fs_chunks
+        c.execute("""CREATE TABLE IF NOT EXISTS bm25_postings(
+                    session_id TEXT, term TEXT, chunk_id TEXT, tf INTEGER,
+                    PRIMARY KEY(session_id, term, chunk_id)) WITHOUT ROWID""")
+        # covering, so scoped scoring reads a chunk's terms and tfs without touching the table
+        c.execute("DROP INDEX IF EXISTS idx_bm25_postings_chunk")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_bm25_postings_chunk_terms ON bm25_postings(chunk_id, term, tf)")
+        # one row per (chunk, tag): scoped retrieval selects its candidates here
+        new_tags = not _columns(c, "chunk_tags")
+        c.execute("""CREATE TABLE IF NOT EXISTS chunk_tags(
+                    session_id TEXT, tag TEXT, chunk_id TEXT,
+                    PRIMARY KEY(session_id, tag, chunk_id)) WITHOUT ROWID""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chunk_tags_chunk ON chunk_tags(chunk_id)")
+        if new_tags:
+            # fs_chunks.tags stays the chunk's own copy; the table is derived from it
+            rows = c.execute("SELECT session_id, id, tags FROM fs_chunks WHERE tags != ''").fetchall()
+            c.executemany("INSERT OR IGNORE INTO chunk_tags(session_id, tag, chunk_id) VALUES(?,?,?)",
+                          [(sid, tag, cid) for sid, cid, tags in rows for tag in tags.split(",") if tag])
+        c.execute("""CREATE TABLE IF NOT EXISTS bm25_docs(
+                    chunk_id TEXT PRIMARY KEY, length INTEGER, session_id TEXT)""")
+        c.execute("""CREATE TABLE IF NOT EXISTS embedding_cache(
+                    embedder TEXT, model TEXT, text_hash BLOB, vec BLOB,
+                    PRIMARY KEY(embedder, model, text_hash)) WITHOUT ROWID""")
+        # chunk id -> row in its session's memory-mapped vector file
+        c.execute("""CREATE TABLE IF NOT EXISTS vec_rows(
+                    chunk_id TEXT PRIMARY KEY, row INTEGER, session_id TEXT NOT NULL DEFAULT 'default')""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_vec_rows_session ON vec_rows(session_id, row)")
+        # columns added after their tables first shipped
+        if "vec_epoch" not in _columns(c, "sessions"):
+            c.execute("ALTER TABLE sessions ADD COLUMN vec_epoch INTEGER NOT NULL DEFAULT 0")
+        if "vec_dtype" not in _columns(c, "sessions"):
+            c.execute("ALTER TABLE sessions ADD COLUMN vec_dtype TEXT NOT NULL DEFAULT 'float32'")
+        if "vec_embedder" not in _columns(c, "sessions"):
+            # NULL: vectors written before the embedder was recorded
+            c.execute("ALTER TABLE sessions ADD COLUMN vec_embedder TEXT")
+        if "hits" not in _columns(c, "fs_chunks"):
+            c.execute("ALTER TABLE fs_chunks ADD COLUMN hits INTEGER NOT NULL DEFAULT 0")
+            c.execute("ALTER TABLE fs_chunks ADD COLUMN created REAL")
+            # unknown age counts from now, so nothing is evicted just for predating the column
+            c.execute("UPDATE fs_chunks SET created=?", (time.time(),))
+        c.execute("""INSERT OR IGNORE INTO sessions(session_id, ac, state_version, fs_version, n_docs, total_len, vec_dim)
+                     VALUES(?, '[]', 0, 0, 0, 0, 0)""", (self.session_id,))
+        self._migrate_legacy_meta(c)
+        self.conn.commit()
+        # move a YAML ledger written by older versions into ledger_entries
+        legacy = c.execute("SELECT yaml FROM ledger WHERE id=1").fetchone()
+        if legacy is not None and self.session_id == DEFAULT_SESSION:
+            self.merge_ledger(DecisionLedger(**(yaml.safe_load(legacy[0]) or {})))
+            c.execute("DELETE FROM ledger")
+            self.conn.commit()
+        # backfill the text index for databases created before it existed
+        (n_idx,) = c.execute("SELECT n_docs FROM sessions WHERE session_id=?", (self.session_id,)).fetchone()
+        if rebuild or n_idx != self.count_fs():
+            self.rebuild_text_index()
+        self._open_vectors()
+
+    def _migrate_sessions(self, c: sqlite3.Cursor) -> bool:
+        """Add session columns to tables created before sessions existed; True if the text index was dropped."""
+        for table in ("transcripts", "fs_chunks", "vec_rows"):
+            cols = _columns(c, table)
+            if cols and "session_id" not in cols:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN session_id TEXT NOT NULL DEFAULT 'default'")
+        cols = _columns(c, "ledger_entries")
+        if cols and "session_id" not in cols:
+            # the primary key changes, so the table is copied
+            c.execute("ALTER TABLE ledger_entries RENAME TO ledger_entries_v1")
+            c.execute("""CREATE TABLE ledger_entries(
+                        session_id TEXT, field TEXT, key TEXT, value TEXT, token_count INTEGER,
+                        first_seen TEXT, hit_count INTEGER, seq INTEGER,
+                        PRIMARY KEY(session_id, field, key))""")
+            c.execute("""INSERT INTO ledger_entries SELECT 'default', field, key, value, token_count,
+                         first_seen, hit_count, seq FROM ledger_entries_v1""")
+            c.execute("DROP TABLE ledger_entries_v1")
+        cols = _columns(c, "bm25_postings")
+        if cols and "session_id" not in cols:
+            # derived data: dropped here and rebuilt from fs_chunks
+            c.execute("DROP TABLE bm25_postings")
+            c.execute("DROP TABLE IF EXISTS bm25_docs")
+            c.execute("DROP TABLE IF EXISTS bm25_stats")
+            return True
+        return False
+
+    def _migrate_legacy_meta(self, c: sqlite3.Cursor) -> None:
+        # pre-session databases kept AC, versions and vec_dim as global meta keys
+        rows = dict(c.execute("""SELECT key, value FROM meta
+                                 WHERE key IN ('ac','state_version','fs_version','vec_dim')"""))
+        if not rows:
+            return
+        c.execute("""INSERT OR IGNORE INTO sessions(session_id, ac, state_version, fs_version, n_docs, total_len, vec_dim)
+                     VALUES('default', '[]', 0, 0, 0, 0, 0)""")
+        c.execute("""UPDATE sessions SET ac=?, state_version=?, fs_version=?, vec_dim=?
+                     WHERE session_id='default'""",
+                  (rows.get("ac", "[]"), int(rows.get("state_version", 0)), int(rows.get("fs_version", 0)),
+                   int(rows.get("vec_dim", 0))))
+        c.execute("DELETE FROM meta WHERE key IN ('ac','state_version','fs_version','vec_dim')")
+
+    # transactions
+    def _commit(self) -> None:
+        if self._batch_depth:
+            return
+        if self.write_behind > 0 and time.monotonic() - self._last_commit < self.write_behind:
+            return
         self.conn.commit()
+        self._last_commit = time.monotonic()
+
+    @contextmanager
+    def batch(self):
+        """Unit of work: all writes inside commit once on exit, or roll back on error.
+
+        Holds the write lock throughout, so other threads' writes wait for it.
+        """
+        with self._write():
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.conn.rollback()
+                    self._reload_rows()
+                raise
+            self._batch_depth -= 1
+            self._commit()
+
+    @contextmanager
+    def exclusive(self):
+        """Hold the write lock without opening a transaction, e.g. around calls that commit on
+        their own (``compact_vectors``) plus work that must not interleave with other writers."""
+        with self._write():
+            yield self
+
+    @_writes
+    def flush(self) -> None:
+        """Commit writes held back by write-behind mode."""
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self._last_commit = time.monotonic()
+
+    def _flush_loop(self) -> None:
+        # commits a write-behind backlog that no later write comes along to commit
+        while not self._closed.wait(self.write_behind):
+            try:
+                if self._writer.in_transaction and time.monotonic() - self._last_commit >= self.write_behind:
+                    self.flush()
+            except sqlite3.ProgrammingError:  # closed meanwhile
+                return
+
+    def close(self) -> None:
+        self._closed.set()
+        self.flush()
+        with self._write_lock, self._rows_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+            self._writer.close()
 
     # transcripts
+    @_writes
     def append_turn(self, turn: Turn) -> int:
         c = self.conn.cursor()
-        c.execute("INSERT INTO transcripts(role,text,ts) VALUES(?,?,?)", (turn.role, turn.text, turn.ts.isoformat()))
-        self.conn.commit()
+        c.execute("INSERT INTO transcripts(role,text,ts,session_id) VALUES(?,?,?,?)",
+                  (turn.role, turn.text, turn.ts.isoformat(), self.session_id))
+        self._commit()
         return c.lastrowid
 
+    @_reads
     def last_turns(self, n: int) -> List[Turn]:
         c = self.conn.cursor()
-        rows = c.execute("SELECT role,text,ts FROM transcripts ORDER BY turn_id DESC LIMIT ?", (n,)).fetchall()
+        rows = c.execute("SELECT role,text,ts FROM transcripts WHERE session_id=? ORDER BY turn_id DESC LIMIT ?",
+                         (self.session_id, n)).fetchall()
         rows.reverse()
         return [Turn(role=r[0], text=r[1], ts=r[2]) for r in rows]
 
     # ledger
+    @_reads
     def load_ledger(self) -> DecisionLedger:
+        dl = DecisionLedger()
+        rows = self.conn.execute("SELECT field,key,value FROM ledger_entries WHERE session_id=? ORDER BY seq",
+                                 (self.session_id,)).fetchall()
+        for field, key, value in rows:
+            if field == "ids":
+                dl.ids[key] = value
+            else:
+                getattr(dl, field).append(value)
+        return dl
+
+    @_reads
+    def ledger_entries(self) -> List[tuple]:
+        """(field, key, value, token_count, hit_count) rows, oldest first."""
+        return self.conn.execute("""SELECT field,key,value,token_count,hit_count FROM ledger_entries
+                                    WHERE session_id=? ORDER BY seq""", (self.session_id,)).fetchall()
+
+    @_writes
+    def merge_ledger(self, delta: DecisionLedger) -> None:
+        """Add ``delta``'s entries; a repeated entry bumps its hit_count and recency instead of duplicating."""
+        c = self.conn.cursor()
+        (seq,) = c.execute("SELECT COALESCE(MAX(seq), 0) FROM ledger_entries WHERE session_id=?",
+                           (self.session_id,)).fetchone()
+        now = datetime.utcnow().isoformat()
+        items = [(f, v, v) for f in LEDGER_LISTS for v in getattr(delta, f)]
+        items += [("ids", k, v) for k, v in delta.ids.items()]
+        token_counts = len_tokens_many([_entry_yaml(*item) for item in items])
+        for (field, key, value), n_tokens in zip(items, token_counts):
+            seq += 1
+            c.execute("""INSERT INTO ledger_entries(session_id,field,key,value,token_count,first_seen,hit_count,seq)
+                         VALUES(?,?,?,?,?,?,1,?)
+                         ON CONFLICT(session_id,field,key) DO UPDATE SET
+                           value=excluded.value, token_count=excluded.token_count,
+                           hit_count=hit_count+1, seq=excluded.seq""",
+                      (self.session_id, field, key, value, n_tokens, now, seq))
+        if items:
+            self._bump_state_version(c)
+        self._commit()
+
+    @_reads
+    def ledger_tokens(self) -> int:
+        """Token size of the ledger's YAML, summed from per-entry counts."""
+        (total,) = self.conn.execute("SELECT COALESCE(SUM(token_count), 0) FROM ledger_entries WHERE session_id=?",
+                                      (self.session_id,)).fetchone()
+        return _ledger_overhead() + total
+
+    @_writes
+    def trim_ledger(self, cap_tokens: int) -> None:
+        """Drop the least recent list entries, one field at a time, until the ledger fits ``cap_tokens``."""
+        total = self.ledger_tokens()
+        if total <= cap_tokens:
+            return
+        queues: Dict[str, list] = {f: [] for f in LEDGER_LISTS}
+        for field, key, tokens in self.conn.execute(
+                """SELECT field,key,token_count FROM ledger_entries
+                   WHERE session_id=? AND field != 'ids' ORDER BY seq DESC""", (self.session_id,)):
+            queues[field].append((key, tokens))
+        dropped = []
+        while total > cap_tokens and any(queues.values()):
+            for field in LEDGER_LISTS:
+                if queues[field]:
+                    key, tokens = queues[field].pop()
+                    dropped.append((field, key))
+                    total -= tokens
+                    if total <= cap_tokens:
+                        break
         c = self.conn.cursor()
-        (yaml_txt,) = c.execute("SELECT yaml FROM ledger WHERE id=1").fetchone()
-        data = yaml.safe_load(yaml_txt) or {}
-        return DecisionLedger(**data)
+        c.executemany("DELETE FROM ledger_entries WHERE session_id=? AND field=? AND key=?",
+                      [(self.session_id, f, k) for f, k in dropped])
+        self._bump_state_version(c)
+        self._commit()
 
+    @_writes
     def save_ledger(self, dl: DecisionLedger) -> None:
+        """Replace the whole ledger with ``dl``."""
         c = self.conn.cursor()
-        c.execute("UPDATE ledger SET yaml=? WHERE id=1", (yaml.dump(dl.model_dump()),))
-        self.conn.commit()
+        c.execute("DELETE FROM ledger_entries WHERE session_id=?", (self.session_id,))
+        self.merge_ledger(dl)
+        self._bump_state_version(c)
+        self._commit()
 
-    # meta AC
+    # AC
+    @_reads
     def load_ac(self) -> List[Turn]:
         c = self.conn.cursor()
-        (txt,) = c.execute("SELECT value FROM meta WHERE key='ac'").fetchone()
+        (txt,) = c.execute("SELECT ac FROM sessions WHERE session_id=?", (self.session_id,)).fetchone()
         data = json.loads(txt)
         return [Turn(**t) for t in data]
 
+    @_writes
     def save_ac(self, turns: List[Turn]) -> None:
         c = self.conn.cursor()
         serial = json.dumps([t.model_dump(mode="json") for t in turns])
-        c.execute("INSERT OR REPLACE INTO meta(key,value) VALUES('ac', ?)" , (serial,))
-        self.conn.commit()
+        c.execute("UPDATE sessions SET ac=? WHERE session_id=?", (serial, self.session_id))
+        self._bump_state_version(c)
+        self._commit()
+
+    # AC/DL version counter, bumped on every save so cached copies can detect staleness
+    def _bump_state_version(self, c: sqlite3.Cursor) -> None:
+        c.execute("UPDATE sessions SET state_version=state_version+1 WHERE session_id=?", (self.session_id,))
+
+    @_reads
+    def state_version(self) -> int:
+        (v,) = self.conn.execute("SELECT state_version FROM sessions WHERE session_id=?",
+                                 (self.session_id,)).fetchone()
+        return v
+
+    @_reads
+    def versions(self) -> tuple:
+        """(state_version, fs_version): together they change on every write compose depends on."""
+        return tuple(self.conn.execute("SELECT state_version, fs_version FROM sessions WHERE session_id=?",
+                                       (self.session_id,)).fetchone())
+
+    @_reads
+    def sessions(self) -> List[str]:
+        """Every session id stored in this database."""
+        return [r[0] for r in self.conn.execute("SELECT session_id FROM sessions ORDER BY session_id")]
 
     # FS chunks
     def upsert_fs_chunk(self, chunk: FSChunk) -> None:
-        vec_blob = None
-        if chunk.vec is not None:
-            vec_blob = chunk.vec.astype(np.float32).tobytes()
-        tags_txt = ",".join(chunk.tags)
+        self.upsert_fs_chunks([chunk])
+
+    @_writes
+    def upsert_fs_chunks(self, chunks: List[FSChunk]) -> None:
         c = self.conn.cursor()
-        c.execute("REPLACE INTO fs_chunks(id,type,tags,text,src_turn,vec) VALUES(?,?,?,?,?,?)",
-                  (chunk.id, chunk.type, tags_txt, chunk.text, chunk.src_turn, vec_blob))
-        self.conn.commit()
+        self._write_vectors(c, [(ch.id, ch.vec) for ch in chunks if ch.vec is not None])
+        now = time.time()
+        # an update keeps the chunk's hits and creation time
+        c.executemany("""INSERT INTO fs_chunks(id,type,tags,text,src_turn,vec,session_id,created)
+                         VALUES(?,?,?,?,?,NULL,?,?)
+                         ON CONFLICT(id) DO UPDATE SET type=excluded.type, tags=excluded.tags, text=excluded.text,
+                           src_turn=excluded.src_turn, vec=NULL, session_id=excluded.session_id""",
+                      [(ch.id, ch.type, ",".join(ch.tags), ch.text, ch.src_turn, self.session_id, now)
+                       for ch in chunks])
+        for ch in chunks:
+            self._index_text(c, ch.id, bm25.doc_text(ch.text, ch.tags))
+        c.executemany("DELETE FROM chunk_tags WHERE chunk_id=?", [(ch.id,) for ch in chunks])
+        c.executemany("INSERT OR IGNORE INTO chunk_tags(session_id, tag, chunk_id) VALUES(?,?,?)",
+                      [(self.session_id, tag, ch.id) for ch in chunks for tag in ch.tags])
+        c.execute("UPDATE sessions SET fs_version=fs_version+1 WHERE session_id=?", (self.session_id,))
+        self._commit()
+
+    def _rows_to_chunks(self, rows: List[tuple]) -> List[FSChunk]:
+        # one refresh and one bulk decode for every row's vector
+        with self._rows_lock:
+            mat = self.vector_matrix()
+            pos = [self._row_of.get(r[0]) for r in rows]
+        have = [i for i, p in enumerate(pos) if p is not None]
+        vec_of = dict(zip(have, quantize.decode(mat[[pos[i] for i in have]], self.vec_dtype))) if have else {}
+        return [FSChunk(id=r[0], type=r[1], tags=r[2].split(',') if r[2] else [], text=r[3], src_turn=r[4],
+                        vec=vec_of.get(i)) for i, r in enumerate(rows)]
 
+    @_reads
     def load_fs_chunks(self) -> List[FSChunk]:
         c = self.conn.cursor()
-        rows = c.execute("SELECT id,type,tags,text,src_turn,vec FROM fs_chunks").fetchall()
-        chunks = []
-        for r in rows:
-            vec = None
-            if r[5] is not None:
-                arr = np.frombuffer(r[5], dtype=np.float32)
-                vec = arr
-            tags = r[2].split(',') if r[2] else []
-            chunks.append(FSChunk(id=r[0], type=r[1], tags=tags, text=r[3], src_turn=r[4], vec=vec))
-        return chunks
+        rows = c.execute("SELECT id,type,tags,text,src_turn FROM fs_chunks WHERE session_id=?",
+                         (self.session_id,)).fetchall()
+        return self._rows_to_chunks(rows)
 
+    @_reads
+    def get_fs_chunks(self, ids: List[str]) -> List[FSChunk]:
+        """Chunks for ``ids`` in the given order; unknown ids are skipped."""
+        c = self.conn.cursor()
+        rows = []
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows += c.execute(f"""SELECT id,type,tags,text,src_turn FROM fs_chunks
+                                  WHERE session_id=? AND id IN ({marks})""", [self.session_id, *batch]).fetchall()
+        found = {ch.id: ch for ch in self._rows_to_chunks(rows)}
+        return [found[i] for i in ids if i in found]
+
+    @_reads
+    def tagged_chunk_ids(self, tags: List[str]) -> List[str]:
+        """Ids of chunks carrying any of ``tags``, read from the ``chunk_tags`` index."""
+        tags = sorted(set(tags))
+        if not tags:
+            return []
+        marks = ",".join("?" * len(tags))
+        rows = self.conn.execute(f"""SELECT DISTINCT chunk_id FROM chunk_tags
+                                     WHERE session_id=? AND tag IN ({marks})""", [self.session_id, *tags])
+        return [r[0] for r in rows]
+
+    @_reads
+    def tag_counts(self) -> Dict[str, int]:
+        """tag -> number of chunks carrying it."""
+        return dict(self.conn.execute("SELECT tag, COUNT(*) FROM chunk_tags WHERE session_id=? GROUP BY tag",
+                                      (self.session_id,)))
+
+    @_reads
     def count_fs(self) -> int:
         c = self.conn.cursor()
-        (n,) = c.execute("SELECT COUNT(*) FROM fs_chunks").fetchone()
+        (n,) = c.execute("SELECT COUNT(*) FROM fs_chunks WHERE session_id=?", (self.session_id,)).fetchone()
         return n
+
+    @_reads
+    def chunk_stats(self) -> Dict[str, tuple]:
+        """chunk id -> (hits, created unix time)."""
+        rows = self.conn.execute("SELECT id, hits, created FROM fs_chunks WHERE session_id=?", (self.session_id,))
+        return {cid: (hits, created or 0.0) for cid, hits, created in rows}
+
+    @_writes
+    def record_hits(self, counts: Dict[str, int]) -> None:
+        """Add retrieval or merge hits; not a content change, so versions stay put."""
+        self.conn.executemany("UPDATE fs_chunks SET hits=hits+? WHERE id=? AND session_id=?",
+                              [(n, cid, self.session_id) for cid, n in counts.items()])
+        self._commit()
+
+    @_writes
+    def set_chunk_stats(self, stats: Dict[str, tuple]) -> None:
+        self.conn.executemany("UPDATE fs_chunks SET hits=?, created=? WHERE id=? AND session_id=?",
+                              [(hits, created, cid, self.session_id) for cid, (hits, created) in stats.items()])
+        self._commit()
+
+    @_writes
+    def delete_fs_chunks(self, ids: List[str]) -> None:
+        """Remove chunks with their postings and vector rows (the rows go dead until ``compact_vectors``)."""
+        c = self.conn.cursor()
+        for i in range(0, len(ids), 500):
+            batch = list(ids[i:i + 500])
+            marks = ",".join("?" * len(batch))
+            (n_docs, total_len) = c.execute(f"""SELECT COUNT(*), COALESCE(SUM(length), 0) FROM bm25_docs
+                                                WHERE session_id=? AND chunk_id IN ({marks})""",
+                                            [self.session_id, *batch]).fetchone()
+            c.execute("UPDATE sessions SET n_docs=n_docs-?, total_len=total_len-? WHERE session_id=?",
+                      (n_docs, total_len, self.session_id))
+            for table, column in (("bm25_postings", "chunk_id"), ("bm25_docs", "chunk_id"),
+                                  ("chunk_tags", "chunk_id"), ("vec_rows", "chunk_id"), ("fs_chunks", "id")):
+                c.execute(f"DELETE FROM {table} WHERE session_id=? AND {column} IN ({marks})",
+                          [self.session_id, *batch])
+        with self._rows_lock:
+            for cid in ids:
+                row = self._row_of.pop(cid, None)
+                if row is not None:
+                    self._row_ids[row] = None
+                    self._live[row] = False
+        c.execute("UPDATE sessions SET fs_version=fs_version+1 WHERE session_id=?", (self.session_id,))
+        self._commit()
+
+    # vector matrix
+    def _vec_path(self, epoch: int, dtype: str) -> str:
+        # compact_vectors writes each new generation of the file under a new name; the epoch
+        # goes after ".vecs" so it can never read as another session's slug (slugs have no dots)
+        epoch_part = f".{epoch}" if epoch else ""
+        return os.path.join(self.index_dir, f"{self.name}.vecs{epoch_part}.{quantize.SUFFIX[dtype]}")
+
+    def _vec_settings(self) -> None:
+        (self.vec_dim, epoch, self.vec_dtype, self.vec_embedder) = self.conn.execute(
+            "SELECT vec_dim, vec_epoch, vec_dtype, vec_embedder FROM sessions WHERE session_id=?",
+            (self.session_id,)).fetchone()
+        self.vec_path = self._vec_path(epoch, self.vec_dtype)
+        legacy = os.path.join(self.index_dir, f"{self.name}.{epoch}.vecs.{quantize.SUFFIX[self.vec_dtype]}")
+        if epoch and not os.path.exists(self.vec_path) and os.path.exists(legacy):
+            # compacted files used to be named <name>.<epoch>.vecs.*
+            os.replace(legacy, self.vec_path)
+
+    def _open_vectors(self) -> None:
+        c = self.conn.cursor()
+        self._vec_settings()
+        self._mm: Optional[np.memmap] = None
+        self._row_ids: List[Optional[str]] = []
+        self._row_of: Dict[str, int] = {}
+        self._live = np.zeros(0, dtype=bool)
+        self._n_rows = 0
+        self._file_rows = 0
+        if self.vec_dim and os.path.exists(self.vec_path):
+            row_bytes = quantize.row_bytes(self.vec_dtype, self.vec_dim)
+            size = os.path.getsize(self.vec_path)
+            if size % row_bytes:
+                # drop a torn trailing append
+                with open(self.vec_path, "r+b") as f:
+                    f.truncate(size - size % row_bytes)
+        self._refresh_rows()
+        # migrate vectors stored as BLOBs by older versions
+        legacy = c.execute("SELECT id, vec FROM fs_chunks WHERE session_id=? AND vec IS NOT NULL",
+                           (self.session_id,)).fetchall()
+        for chunk_id, blob in legacy:
+            self._write_vector(c, chunk_id, np.frombuffer(blob, dtype=np.float32))
+        if legacy:
+            c.execute("UPDATE fs_chunks SET vec=NULL WHERE session_id=?", (self.session_id,))
+            self.conn.commit()
+
+    @_rows_locked
+    def _reload_rows(self) -> None:
+        # after a rollback or a compaction the in-memory row map may reference rows SQLite no longer maps
+        self._vec_settings()
+        self._row_ids, self._row_of = [], {}
+        self._live = np.zeros(0, dtype=bool)
+        self._n_rows = self._file_rows = 0
+        self._mm = None
+        self._refresh_rows()
+
+    def _vec_file_rows(self) -> int:
+        if not self.vec_dim or not os.path.exists(self.vec_path):
+            return 0
+        return os.path.getsize(self.vec_path) // quantize.row_bytes(self.vec_dtype, self.vec_dim)
+
+    def _set_row(self, row: int, chunk_id: str) -> None:
+        if row >= len(self._live):
+            grown = np.zeros(max(64, 2 * len(self._live), row + 1), dtype=bool)
+            grown[:len(self._live)] = self._live
+            self._live = grown
+        while len(self._row_ids) <= row:
+            self._row_ids.append(None)
+        old = self._row_of.get(chunk_id)
+        if old is not None and old != row:
+            self._row_ids[old] = None
+            self._live[old] = False
+        self._row_ids[row] = chunk_id
+        self._row_of[chunk_id] = row
+        self._live[row] = True
+        self._n_rows = max(self._n_rows, row + 1)
+
+    @_rows_locked
+    def _refresh_rows(self) -> None:
+        """Pick up rows other connections have appended and committed since we last looked.
+
+        ``_file_rows`` only moves past committed mappings: rows another connection has
+        appended but not committed yet are looked up again on the next call.
+        """
+        if not self.vec_dim:
+            # empty when we opened; another connection may have written the first vectors since
+            self._vec_settings()
+        file_rows = self._vec_file_rows()
+        if file_rows < self._file_rows:
+            # our file was replaced by another connection's compact_vectors
+            self._reload_rows()
+            return
+        self._n_rows = max(self._n_rows, file_rows)
+        if file_rows == self._file_rows:
+            return
+        mapped = self.conn.execute("""SELECT chunk_id, row FROM vec_rows
+                                      WHERE session_id=? AND row >= ? AND row < ? ORDER BY row""",
+                                   (self.session_id, self._file_rows, file_rows)).fetchall()
+        for chunk_id, row in mapped:
+            self._set_row(row, chunk_id)
+        if mapped:
+            self._file_rows = mapped[-1][1] + 1
+
+    def _write_vector(self, c: sqlite3.Cursor, chunk_id: str, vec: np.ndarray) -> None:
+        self._write_vectors(c, [(chunk_id, vec)])
+
+    @_rows_locked
+    def _write_vectors(self, c: sqlite3.Cursor, items: List[tuple]) -> None:
+        """Append (chunk id, vector) rows with one file write; unchanged vectors are skipped.
+
+        SQLite's write lock is taken first and held until the mapping commits, so appends from
+        other connections cannot claim the same rows.
+        """
+        if not items:
+            return
+        if not self.conn.in_transaction:
+            c.execute("BEGIN IMMEDIATE")
+        (epoch, dtype) = c.execute("SELECT vec_epoch, vec_dtype FROM sessions WHERE session_id=?",
+                                   (self.session_id,)).fetchone()
+        if self._vec_path(epoch, dtype) != self.vec_path:
+            # another connection compacted or converted the file since we last looked
+            self._reload_rows()
+        else:
+            self._refresh_rows()
+        start = self._vec_file_rows()
+        rows, mapping = [], []
+        for chunk_id, vec in items:
+            vec = np.ascontiguousarray(vec, dtype=np.float32).ravel()
+            if not self.vec_dim:
+                self.vec_dim = vec.shape[0]
+                c.execute("UPDATE sessions SET vec_dim=? WHERE session_id=?", (self.vec_dim, self.session_id))
+            elif vec.shape[0] != self.vec_dim:
+                raise ValueError(f"vector dim {vec.shape[0]} does not match store dim {self.vec_dim}")
+            row = quantize.encode(vec[None, :], self.vec_dtype).tobytes()
+            old = self._row_of.get(chunk_id)
+            if old is not None and self.vector_matrix()[old:old + 1].tobytes() == row:
+                continue
+            rows.append(row)
+            # after any tail left by another connection's rolled back append
+            mapping.append((chunk_id, start + len(mapping)))
+        if not rows:
+            return
+        # append to the file first so a committed mapping never points past its end
+        with open(self.vec_path, "ab") as f:
+            f.write(b"".join(rows))
+        self._file_rows = start + len(rows)
+        for chunk_id, row in mapping:
+            self._set_row(row, chunk_id)
+        c.executemany("REPLACE INTO vec_rows(chunk_id,row,session_id) VALUES(?,?,?)",
+                      [(chunk_id, row, self.session_id) for chunk_id, row in mapping])
+
+    @_rows_locked
+    def vector_matrix(self) -> np.ndarray:
+        """Zero-copy view of every stored row, live or dead (see ``live_rows``), in ``vec_dtype``.
+
+        Quantized rows go through ``quantize.decode``/``quantize.scores``; ``vector`` and
+        ``vectors`` return them already decoded.
+        """
+        self._refresh_rows()
+        dtype = quantize.row_dtype(self.vec_dtype, self.vec_dim or 0)
+        if not self._n_rows:
+            return np.zeros(quantize.row_shape(self.vec_dtype, 0, self.vec_dim or 0), dtype=dtype)
+        if self._mm is None or self._mm.shape[0] != self._n_rows:
+            self._mm = np.memmap(self.vec_path, dtype=dtype, mode="r",
+                                 shape=quantize.row_shape(self.vec_dtype, self._n_rows, self.vec_dim))
+        return self._mm
+
+    def live_rows(self) -> np.ndarray:
+        """Boolean mask over ``vector_matrix()`` rows that are a chunk's current vector."""
+        return self._live[:self._n_rows]
+
+    def row_ids(self) -> List[Optional[str]]:
+        return self._row_ids
+
+    @_rows_locked
+    def vector_snapshot(self) -> tuple:
+        """Consistent (matrix, live mask, row ids) for scoring while other threads append."""
+        mat = self.vector_matrix()
+        # rows appended by another connection may not be mapped here yet
+        live = np.zeros(len(mat), dtype=bool)
+        live[:min(len(mat), len(self._live))] = self._live[:len(mat)]
+        ids = self._row_ids[:len(mat)]
+        return mat, live, ids + [None] * (len(mat) - len(ids))
+
+    @_rows_locked
+    def vector(self, chunk_id: str) -> Optional[np.ndarray]:
+        row = self._row_of.get(chunk_id)
+        if row is None:
+            self._refresh_rows()
+            row = self._row_of.get(chunk_id)
+        return None if row is None else quantize.decode(self.vector_matrix()[row:row + 1], self.vec_dtype)[0]
+
+    @_rows_locked
+    def vectors(self, chunk_ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        """(the ids that have a vector, their vectors stacked), in the order given."""
+        if any(cid not in self._row_of for cid in chunk_ids):
+            self._refresh_rows()
+        found = [cid for cid in chunk_ids if cid in self._row_of]
+        if not found:
+            return [], np.zeros((0, self.vec_dim), dtype=np.float32)
+        return found, quantize.decode(self.vector_matrix()[[self._row_of[cid] for cid in found]], self.vec_dtype)
+
+    def count_vectors(self) -> int:
+        return len(self._row_of)
+
+    @_rows_locked
+    def vector_stats(self) -> dict:
+        """Storage footprint of this session's vectors."""
+        self._refresh_rows()
+        dim = self.vec_dim or 0
+        per_row = quantize.row_bytes(self.vec_dtype, dim) if dim else 0
+        return {"dtype": self.vec_dtype, "dim": dim, "live": len(self._row_of), "rows": self._n_rows,
+                "file_bytes": self._n_rows * per_row, "bytes_per_vector": per_row,
+                "vs_float32": 4 * dim / per_row if per_row else None}
+
+    @_writes
+    def set_vec_embedder(self, embedder: str) -> None:
+        """Record ``embedder`` (see ``Embedder.cache_id``) as the one this session's vectors come from."""
+        self.conn.execute("UPDATE sessions SET vec_embedder=? WHERE session_id=?", (embedder, self.session_id))
+        self.vec_embedder = embedder
+        self._commit()
+
+    @_writes
+    def compact_vectors(self, dtype: Optional[str] = None) -> int:
+        """Rewrite the vector file with only live rows; returns the number of dead rows dropped.
+
+        With a ``dtype`` other than the session's, every row is converted to it as well.
+        The new file gets the next epoch's name and is fsynced before the remapped
+        ``vec_rows`` and the epoch commit together, so a crash at any point leaves the
+        database pointing at a complete file. Commits on its own: not allowed inside ``batch()``.
+        """
+        if self._batch_depth:
+            raise RuntimeError("compact_vectors commits on its own; call it outside batch()")
+        dtype = quantize.check(dtype or self.vec_dtype)
+        with self._rows_lock:
+            self._refresh_rows()
+            live = np.flatnonzero(self.live_rows())
+            dead = self._n_rows - len(live)
+            if not dead and dtype == self.vec_dtype:
+                return 0
+            mat = self.vector_matrix()
+
+            def blocks():
+                for i in range(0, len(live), 4096):
+                    rows = np.ascontiguousarray(mat[live[i:i + 4096]])
+                    if dtype != self.vec_dtype:
+                        rows = quantize.encode(quantize.decode(rows, self.vec_dtype), dtype)
+                    yield [self._row_ids[r] for r in live[i:i + 4096]], rows
+            self._swap_vectors(blocks(), dtype, self.vec_dim, self.vec_embedder)
+        return dead
+
+    @_writes
+    def replace_vectors(self, blocks: Iterable[Tuple[List[str], np.ndarray]], embedder: str) -> None:
+        """Swap every vector of the session for ``blocks`` of (chunk ids, float32 vectors).
+
+        For re-embedding with another ``embedder``, which is recorded with the new dim. The
+        rows go through the same atomic file rewrite as ``compact_vectors``, so the session
+        keeps its old vectors until the new ones commit. Not allowed inside ``batch()``.
+        """
+        if self._batch_depth:
+            raise RuntimeError("replace_vectors commits on its own; call it outside batch()")
+        encoded = ((ids, quantize.encode(np.asarray(vecs).reshape(len(ids), -1), self.vec_dtype))
+                   for ids, vecs in blocks)
+        with self._rows_lock:
+            self._swap_vectors(encoded, self.vec_dtype, None, embedder)
+
+    def _swap_vectors(self, blocks, dtype: str, dim: Optional[int], embedder: Optional[str]) -> None:
+        # write the next epoch's file, fsync it, then commit its mapping, dim, dtype, epoch and embedder
+        c = self.conn.cursor()
+        (epoch,) = c.execute("SELECT vec_epoch FROM sessions WHERE session_id=?", (self.session_id,)).fetchone()
+        old_path, new_path = self.vec_path, self._vec_path(epoch + 1, dtype)
+        ids: List[str] = []
+        with open(new_path, "wb") as f:
+            for chunk_ids, rows in blocks:
+                if dim is None and len(rows):
+                    # taken from the rows when re-embedding
+                    dim = (rows["q"] if dtype == "int8" else rows).shape[1]
+                f.write(np.ascontiguousarray(rows).tobytes())
+                ids += chunk_ids
+            f.flush()
+            os.fsync(f.fileno())
+        c.execute("DELETE FROM vec_rows WHERE session_id=?", (self.session_id,))
+        c.executemany("INSERT INTO vec_rows(chunk_id,row,session_id) VALUES(?,?,?)",
+                      [(cid, i, self.session_id) for i, cid in enumerate(ids)])
+        c.execute("""UPDATE sessions SET vec_epoch=?, vec_dtype=?, vec_dim=?, vec_embedder=?,
+                     fs_version=fs_version+1 WHERE session_id=?""",
+                  (epoch + 1, dtype, dim or 0, embedder, self.session_id))
+        self.conn.commit()
+        self._last_commit = time.monotonic()
+        self._reload_rows()
+        try:
+            os.remove(old_path)
+        except OSError:  # no vectors before, or still mapped elsewhere on Windows
+            pass
+
+    # embedding cache
+    @_reads
+    def get_embeddings(self, embedder: str, model: str, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        c = self.conn.cursor()
+        found = {}
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            for h, blob in c.execute(f"""SELECT text_hash, vec FROM embedding_cache
+                                         WHERE embedder=? AND model=? AND text_hash IN ({marks})""",
+                                     [embedder, model, *batch]):
+                found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_embeddings(self, embedder: str, model: str, items: List[tuple], block: bool = True) -> bool:
+        """Cache (text hash, vector) pairs; with ``block=False``, return False instead of
+        waiting when another thread holds the write lock."""
+        if not self._write_lock.acquire(blocking=block):
+            return False
+        try:
+            with self._write():
+                c = self.conn.cursor()
+                c.executemany("INSERT OR REPLACE INTO embedding_cache(embedder,model,text_hash,vec) VALUES(?,?,?,?)",
+                              [(embedder, model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items])
+                self._commit()
+        finally:
+            self._write_lock.release()
+        return True
+
+    # BM25 text index
+    def _index_text(self, c: sqlite3.Cursor, chunk_id: str, text: str) -> None:
+        row = c.execute("SELECT length FROM bm25_docs WHERE chunk_id=?", (chunk_id,)).fetchone()
+        d_docs, d_len = 1, 0
+        if row is not None:
+            # re-indexing a merged chunk: drop its old postings first
+            c.execute("DELETE FROM bm25_postings WHERE chunk_id=?", (chunk_id,))
+            d_docs, d_len = 0, -row[0]
+        counts = bm25.term_counts(text)
+        length = sum(counts.values())
+        c.executemany("INSERT INTO bm25_postings(session_id,term,chunk_id,tf) VALUES(?,?,?,?)",
+                      [(self.session_id, t, chunk_id, tf) for t, tf in counts.items()])
+        c.execute("REPLACE INTO bm25_docs(chunk_id,length,session_id) VALUES(?,?,?)",
+                  (chunk_id, length, self.session_id))
+        c.execute("UPDATE sessions SET n_docs=n_docs+?, total_len=total_len+? WHERE session_id=?",
+                  (d_docs, d_len + length, self.session_id))
+
+    @_writes
+    def rebuild_text_index(self) -> None:
+        c = self.conn.cursor()
+        c.execute("DELETE FROM bm25_postings WHERE session_id=?", (self.session_id,))
+        c.execute("DELETE FROM bm25_docs WHERE session_id=?", (self.session_id,))
+        c.execute("UPDATE sessions SET n_docs=0, total_len=0 WHERE session_id=?", (self.session_id,))
+        rows = c.execute("SELECT id,text,tags FROM fs_chunks WHERE session_id=?", (self.session_id,)).fetchall()
+        for chunk_id, text, tags in rows:
+            tags_list = tags.split(',') if tags else []
+            self._index_text(c, chunk_id, bm25.doc_text(text, tags_list))
+        self._commit()
+
+    @_reads
+    def bm25_scores(self, query_terms: List[str], tags: Optional[List[str]] = None) -> Dict[str, float]:
+        """BM25 scores for chunks matching any of ``query_terms``; other chunks score 0.
+
+        With ``tags`` only chunks carrying one of them are scored. Postings are then read
+        either per term, filtered to the subset, or per subset chunk, whichever touches
+        fewer rows, so a small scope stays cheap however common the query terms are.
+        Statistics stay session-wide: a chunk scores the same scoped or not.
+        """
+        terms = sorted(set(query_terms))
+        if not terms or tags is not None and not tags:
+            return {}
+        c = self.conn.cursor()
+        (n_docs, total_len) = c.execute("SELECT n_docs, total_len FROM sessions WHERE session_id=?",
+                                        (self.session_id,)).fetchone()
+        df = None
+        source, args, term_filter = "bm25_postings p", [self.session_id], "p.term IN"
+        where = "p.session_id=?"
+        if tags is not None:
+            tags = sorted(set(tags))
+            subset = f"SELECT chunk_id FROM chunk_tags WHERE session_id=? AND tag IN ({','.join('?' * len(tags))})"
+            (n_scope,) = c.execute(f"SELECT COUNT(DISTINCT chunk_id) FROM ({subset})",
+                                   [self.session_id, *tags]).fetchone()
+            if not n_scope:
+                return {}
+            df = {}
+            for i in range(0, len(terms), 500):
+                batch = terms[i:i + 500]
+                df.update(c.execute(f"""SELECT term, COUNT(*) FROM bm25_postings WHERE session_id=?
+                                        AND term IN ({','.join('?' * len(batch))}) GROUP BY term""",
+                                    [self.session_id, *batch]))
+            if n_scope * total_len / max(n_docs, 1) < sum(df.values()):
+                # walk the subset's postings; the unary + keeps SQLite from probing every term per chunk
+                source = (f"(SELECT DISTINCT chunk_id FROM ({subset})) t CROSS JOIN bm25_postings p "
+                          "INDEXED BY idx_bm25_postings_chunk_terms ON p.chunk_id = t.chunk_id")
+                args, where, term_filter = [self.session_id, *tags], "1", "+p.term IN"
+            else:
+                # scan each term's postings and filter; + again stops a probe per (term, chunk) pair
+                where = f"p.session_id=? AND +p.chunk_id IN ({subset})"
+                args = [self.session_id, self.session_id, *tags]
+        postings: Dict[str, list] = {}
+        doc_lens: Dict[str, int] = {}
+        for i in range(0, len(terms), 500):
+            batch = terms[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows = c.execute(f"""SELECT p.term, p.chunk_id, p.tf, d.length FROM {source}
+                                 JOIN bm25_docs d ON d.chunk_id = p.chunk_id
+                                 WHERE {where} AND {term_filter} ({marks})""", [*args, *batch]).fetchall()
+            for term, chunk_id, tf, length in rows:
+                postings.setdefault(term, []).append((chunk_id, tf))
+                doc_lens[chunk_id] = length
+        return bm25.score(query_terms, postings, doc_lens, n_docs, total_len, df=df)
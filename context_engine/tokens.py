@@ -1,26 +1,107 @@
 """Token utilities using tiktoken when available."""
 from __future__ import annotations
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List
+import hashlib
+import threading
 
 try:
     import tiktoken
 except Exception:  # pragma: no cover - fallback
     tiktoken = None
 
+COUNT_CACHE_SIZE = 8192
+
+_counts: "OrderedDict[tuple, int]" = OrderedDict()
+_counts_lock = threading.Lock()
+
 def _simple_tokenize(text: str) -> List[str]:
     return text.split()
 
+@lru_cache(maxsize=None)
+def get_encoder(model_hint: str = "gpt-4o-mini"):
+    """Cached tiktoken encoder for ``model_hint``, or None when unavailable."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_hint)
+    except Exception:
+        return None
+
+def _key(text: str, model_hint: str) -> tuple:
+    return (model_hint, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+
+def _cache_get(key: tuple):
+    with _counts_lock:
+        n = _counts.get(key)
+        if n is not None:
+            _counts.move_to_end(key)
+        return n
+
+def _cache_put(key: tuple, n: int) -> None:
+    with _counts_lock:
+        _counts[key] = n
+        _counts.move_to_end(key)
+        while len(_counts) > COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+
 def len_tokens(text: str, model_hint: str = "gpt-4o-mini") -> int:
-    if tiktoken is not None:
-        try:
-            enc = tiktoken.encoding_for_model(model_hint)
-            return len(enc.encode(text))
-        except Exception:
-            pass
-    return len(_simple_tokenize(text))
+    key = _key(text, model_hint)
+    n = _cache_get(key)
+    if n is None:
+        enc = get_encoder(model_hint)
+        n = len(enc.encode_ordinary(text)) if enc is not None else len(_simple_tokenize(text))
+        _cache_put(key, n)
+    return n
+
+def len_tokens_many(texts: List[str], model_hint: str = "gpt-4o-mini", num_threads: int = 4) -> List[int]:
+    """Token counts for ``texts``; cache misses are encoded in one threaded batch."""
+    keys = [_key(t, model_hint) for t in texts]
+    counts = [_cache_get(k) for k in keys]
+    missing = [i for i, n in enumerate(counts) if n is None]
+    if missing:
+        enc = get_encoder(model_hint)
+        batch = [texts[i] for i in missing]
+        if enc is not None:
+            fresh = [len(ids) for ids in enc.encode_ordinary_batch(batch, num_threads=num_threads)]
+        else:
+            fresh = [len(_simple_tokenize(t)) for t in batch]
+        for i, n in zip(missing, fresh):
+            counts[i] = n
+            _cache_put(keys[i], n)
+    return counts
+
+def warm_up(model_hint: str = "gpt-4o-mini") -> None:
+    """Load the encoder (and its BPE ranks) ahead of the first real count."""
+    enc = get_encoder(model_hint)
+    if enc is not None:
+        enc.encode("warm up")
 
 def cap_to_tokens(text: str, target: int, model_hint: str = "gpt-4o-mini") -> str:
-    tokens = _simple_tokenize(text)
-    if len(tokens) <= target:
+    """Longest prefix of ``text`` that is at most ``target`` tokens, cut at a token boundary."""
+    enc = get_encoder(model_hint)
+    if enc is None:
+        tokens = _simple_tokenize(text)
+        if len(tokens) <= target:
+            return text
+        return " ".join(tokens[:target])
+    # fast path: BPE never yields more tokens than UTF-8 bytes, and counts may be cached
+    raw = text.encode("utf-8")
+    if len(raw) <= target:
+        return text
+    key = _key(text, model_hint)
+    n = _cache_get(key)
+    if n is not None and n <= target:
+        return text
+    ids = enc.encode_ordinary(text)
+    _cache_put(key, len(ids))
+    if len(ids) <= target:
         return text
-    return " ".join(tokens[:target])
+    keep = max(target, 0)
+    while True:
+        # drop a multi-byte character split by the cut rather than emitting U+FFFD
+        out = enc.decode_bytes(ids[:keep]).decode("utf-8", errors="ignore")
+        if keep == 0 or len(enc.encode_ordinary(out)) <= target:
+            return out
+        keep -= 1
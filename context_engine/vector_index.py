@@ -0,0 +1,304 @@
+"""Vector indexes over FS chunk vectors: persistent FAISS HNSW or exact search over the memory-mapped file."""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Tuple
+import functools
+import os
+import threading
+import numpy as np
+from . import quantize
+
+try:
+    import faiss
+except Exception:  # pragma: no cover - optional dependency
+    faiss = None
+
+
+# query x row scores computed at a time by exact search
+SCORE_BLOCK = 1 << 22
+
+
+def _check_dim(dim: int, index_dim: int, where: str) -> None:
+    # a FAISS dim mismatch is a bare assert; say what is wrong instead
+    if index_dim and dim != index_dim:
+        raise ValueError(f"{dim}-dim vectors do not fit the {index_dim}-dim vectors of {where}; "
+                         "the session was embedded with another embedder")
+
+
+def _locked(method):
+    # FAISS HNSW is not safe to search while it is being added to
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class VectorIndex:
+    """Inner-product HNSW index persisted under ``index_dir``.
+
+    FAISS labels are assigned sequentially and ``<name>.labels`` records the chunk id of
+    every label, one per line, append-only. A chunk re-added after a merge gets a fresh
+    label; its older labels become tombstones that are skipped at query time and dropped
+    on the next rebuild. Calls are serialized by a lock, so one index can serve several threads.
+
+    With ``dtype`` "float16" or "int8" the graph keeps scalar-quantized vectors (FAISS
+    ``IndexHNSWSQ``), and the candidates it returns are rescored with the float32 query
+    against ``store``'s own vectors before the top ``k`` are cut.
+    """
+    def __init__(self, index_dir: str, name: str = "fs", m: int = 32, ef_search: int = 64, save_every: int = 256,
+                 dtype: str = "float32", store=None):
+        if faiss is None:
+            raise RuntimeError("faiss is not installed")
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_path = os.path.join(index_dir, f"{name}.hnsw")
+        self.labels_path = os.path.join(index_dir, f"{name}.labels")
+        self.m = m
+        self.ef_search = ef_search
+        self.save_every = save_every
+        self.dtype = quantize.check(dtype)
+        self.store = store
+        self.index = None
+        self.labels: List[str] = []
+        self.current: Dict[str, int] = {}
+        self._unsaved = 0
+        self._lock = threading.RLock()
+        if os.path.exists(self.labels_path):
+            with open(self.labels_path, "r", encoding="utf-8") as f:
+                self.labels = f.read().split()
+            self.current = {cid: i for i, cid in enumerate(self.labels)}
+        if os.path.exists(self.index_path):
+            self.index = faiss.read_index(self.index_path)
+
+    def __len__(self) -> int:
+        return len(self.current)
+
+    @property
+    def stale(self) -> int:
+        return len(self.labels) - len(self.current)
+
+    def _new_index(self, dim: int):
+        if self.dtype == "float32":
+            index = faiss.IndexHNSWFlat(dim, self.m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            qtype = faiss.ScalarQuantizer.QT_fp16 if self.dtype == "float16" else faiss.ScalarQuantizer.QT_8bit
+            index = faiss.IndexHNSWSQ(dim, qtype, self.m, faiss.METRIC_INNER_PRODUCT)
+            # embeddings are unit vectors: a fixed [-1, 1] range per dimension needs no training data
+            index.train(np.vstack([-np.ones(dim), np.ones(dim)]).astype(np.float32))
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def _rescore(self, q: np.ndarray, hits: List[List[Tuple[str, float]]]) -> List[List[Tuple[str, float]]]:
+        # one store read for every query's candidates, then one small product per query
+        if self.dtype == "float32" or self.store is None:
+            return hits
+        ids, vecs = self.store.vectors(list(dict.fromkeys(cid for found in hits for cid, _ in found)))
+        pos = {cid: i for i, cid in enumerate(ids)}
+        out = []
+        for q_vec, found in zip(q, hits):
+            cand = [pos[cid] for cid, _ in found if cid in pos]
+            scores = vecs[cand] @ q_vec
+            out.append([(ids[cand[i]], float(scores[i])) for i in np.argsort(-scores, kind="stable")])
+        return out
+
+    def _append(self, ids: List[str], vecs: np.ndarray) -> None:
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32).reshape(len(ids), -1)
+        if self.index is None:
+            self.index = self._new_index(vecs.shape[1])
+        _check_dim(vecs.shape[1], self.index.d, self.index_path)
+        self.index.add(vecs)
+        self._unsaved += len(ids)
+
+    def add(self, chunk_id: str, vec: np.ndarray) -> None:
+        """Insert or replace the vector for ``chunk_id``."""
+        self.add_many([chunk_id], np.asarray(vec)[None, :])
+
+    @_locked
+    def add_many(self, chunk_ids: List[str], vecs: np.ndarray) -> None:
+        if not chunk_ids:
+            return
+        with open(self.labels_path, "a", encoding="utf-8") as f:
+            f.write("".join(cid + "\n" for cid in chunk_ids))
+        for cid in chunk_ids:
+            self.current[cid] = len(self.labels)
+            self.labels.append(cid)
+        self._append(chunk_ids, vecs)
+
+    @_locked
+    def rebuild(self, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        """Replace the whole index with ``items`` (chunk id, vector)."""
+        items = [(cid, v) for cid, v in items if v is not None]
+        self.index = None
+        self.labels = [cid for cid, _ in items]
+        self.current = {cid: i for i, cid in enumerate(self.labels)}
+        with open(self.labels_path, "w", encoding="utf-8") as f:
+            f.write("".join(cid + "\n" for cid in self.labels))
+        if items:
+            self._append(self.labels, np.vstack([v for _, v in items]))
+        self.save()
+
+    @_locked
+    def sync(self, store) -> None:
+        """Reconcile with ``store`` after a restart or an unclean shutdown.
+
+        Rebuilds unless the index holds exactly the store's chunk ids at the store's dim.
+        """
+        ntotal = self.index.ntotal if self.index is not None else 0
+        redim = self.index is not None and self.index.d != store.vec_dim
+        if (redim or ntotal > len(self.labels) or self.current.keys() != store.chunk_stats().keys()
+                or self.stale > max(1024, len(self.current))):
+            self.rebuild((c.id, c.vec) for c in store.load_fs_chunks())
+        elif ntotal < len(self.labels):
+            # labels were appended but the index file was not saved: replay the tail
+            tail = self.labels[ntotal:]
+            vecs = {c.id: c.vec for c in store.get_fs_chunks(list(set(tail)))}
+            if any(vecs.get(cid) is None for cid in tail):
+                self.rebuild((c.id, c.vec) for c in store.load_fs_chunks())
+                return
+            self._append(tail, np.vstack([vecs[cid] for cid in tail]))
+            self.save()
+
+    @_locked
+    def save(self) -> None:
+        if self.index is None:
+            return
+        tmp = self.index_path + ".tmp"
+        faiss.write_index(self.index, tmp)
+        os.replace(tmp, self.index_path)
+        self._unsaved = 0
+
+    def maybe_save(self) -> None:
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    @_locked
+    def search(self, q_vec: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """Top ``k`` live chunks by inner product with ``q_vec``."""
+        if self.index is None or not self.current:
+            return []
+        q = np.ascontiguousarray(q_vec, dtype=np.float32).reshape(1, -1)
+        _check_dim(q.shape[1], self.index.d, self.index_path)
+        ntotal = self.index.ntotal
+        fetch = min(ntotal, 2 * k + 16)
+        while True:
+            self.index.hnsw.efSearch = max(self.ef_search, fetch)
+            scores, labels = self.index.search(q, fetch)
+            hits: List[Tuple[str, float]] = []
+            for s, label in zip(scores[0], labels[0]):
+                if label < 0:
+                    continue
+                cid = self.labels[label]
+                if self.current.get(cid) == label:
+                    hits.append((cid, float(s)))
+            if len(hits) >= k or fetch >= ntotal:
+                return self._rescore(q, [hits])[0][:k]
+            fetch = min(ntotal, fetch * 2)
+
+    @_locked
+    def search_many(self, q_vecs: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        """``search`` for every row of ``q_vecs`` with one FAISS call."""
+        if self.index is None or not self.current:
+            return [[] for _ in range(len(q_vecs))]
+        q = np.ascontiguousarray(q_vecs, dtype=np.float32).reshape(len(q_vecs), -1)
+        _check_dim(q.shape[1], self.index.d, self.index_path)
+        fetch = min(self.index.ntotal, 2 * k + 16)
+        self.index.hnsw.efSearch = max(self.ef_search, fetch)
+        scores, labels = self.index.search(q, fetch)
+        results = []
+        for i in range(len(q)):
+            results.append([(self.labels[l], float(s)) for s, l in zip(scores[i], labels[i])
+                            if l >= 0 and self.current.get(self.labels[l]) == l])
+        results = [hits[:k] for hits in self._rescore(q, results)]
+        for i, hits in enumerate(results):
+            # too many tombstones near this query: fall back to the widening search
+            if len(hits) < min(k, len(self.current)):
+                results[i] = self.search(q[i], k)
+        return results
+
+
+class ExactIndex:
+    """Brute-force inner-product search over the Store's memory-mapped vector matrix.
+
+    Same interface as VectorIndex. The store already persists every vector, so updates are
+    no-ops here and queries score a zero-copy view with dead rows masked out. Quantized
+    rows are dequantized a block at a time, so scores are exact for the stored vectors.
+    """
+    stale = 0
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self) -> int:
+        return self.store.count_vectors()
+
+    def add(self, chunk_id: str, vec: np.ndarray) -> None:
+        pass
+
+    def add_many(self, chunk_ids: List[str], vecs: np.ndarray) -> None:
+        pass
+
+    def rebuild(self, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        pass
+
+    def sync(self, store) -> None:
+        pass
+
+    def save(self) -> None:
+        pass
+
+    def maybe_save(self) -> None:
+        pass
+
+    def search(self, q_vec: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        return self.search_many(np.asarray(q_vec)[None, :], k)[0]
+
+    def search_many(self, q_vecs: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        """``search`` for every row of ``q_vecs``, a block of matrix rows at a time.
+
+        Each block is scored into one reused buffer and only every query's running top ``k``
+        is kept, so scratch memory is bounded by ``SCORE_BLOCK`` rather than queries x rows.
+        """
+        mat, live, ids = self.store.vector_snapshot()
+        q = np.ascontiguousarray(q_vecs, dtype=np.float32).reshape(len(q_vecs), -1)
+        k = min(k, int(live.sum()))
+        if not len(mat) or k <= 0:
+            return [[] for _ in range(len(q))]
+        _check_dim(q.shape[1], self.store.vec_dim, self.store.vec_path)
+        m, at = len(q), np.arange(len(q))[:, None]
+        step = max(k, min(quantize.BLOCK, SCORE_BLOCK // m))
+        buf = np.empty((m, step), dtype=np.float32)
+        best = np.full((m, k), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((m, k), dtype=np.int64)
+        for lo in range(0, len(mat), step):
+            n = min(step, len(mat) - lo)
+            scores = buf[:, :n]
+            np.matmul(q, quantize.decode(mat[lo:lo + n], self.store.vec_dtype).T, out=scores)
+            scores[:, ~live[lo:lo + n]] = -np.inf
+            # the block's own top k, then merged with the running top k
+            top = np.argpartition(scores, n - min(k, n), axis=1)[:, n - min(k, n):]
+            merged = np.concatenate([best, scores[at, top]], axis=1)
+            merged_rows = np.concatenate([best_rows, top + lo], axis=1)
+            keep = np.argpartition(merged, merged.shape[1] - k, axis=1)[:, -k:]
+            best, best_rows = merged[at, keep], merged_rows[at, keep]
+        order = np.argsort(best, axis=1, kind="stable")[:, ::-1]
+        best, best_rows = best[at, order], best_rows[at, order]
+        return [[(ids[r], float(s)) for r, s in zip(rows, row_scores)] for rows, row_scores in zip(best_rows, best)]
+
+
+def open_vector_index(store, name: str = "fs", mode: str = "hnsw"):
+    """Return a VectorIndex in ``store.index_dir``, or an ExactIndex for ``mode="exact"`` or without FAISS.
+
+    The HNSW index quantizes like the store; each dtype has its own files, so switching
+    dtype rebuilds the index on the next ``sync``. The other dtypes' files are deleted then:
+    they describe vectors the store no longer has.
+    """
+    if mode == "exact" or faiss is None:
+        return ExactIndex(store)
+    if mode != "hnsw":
+        raise ValueError(f"unknown vector search mode: {mode}")
+    names = {kind: name if kind == "float32" else f"{name}.{quantize.SUFFIX[kind]}" for kind in quantize.DTYPES}
+    for kind, stale in names.items():
+        for ext in (".hnsw", ".labels"):
+            path = os.path.join(store.index_dir, stale + ext)
+            if kind != store.vec_dtype and os.path.exists(path):
+                os.remove(path)
+    return VectorIndex(store.index_dir, name=names[store.vec_dtype], dtype=store.vec_dtype, store=store)
@@ -0,0 +1,12 @@
+from context_engine.bench import run, synthetic_pairs
+
+
+def test_bench_reports_every_phase(tmp_path):
+    assert list(synthetic_pairs(50, seed=3)) == list(synthetic_pairs(50, seed=3))
+    report = run(chunks=120, queries=8, batch_size=32, embedder="hash", workdir=str(tmp_path))
+    assert report["fs_chunks"] == report["ingest"]["chunks_new"] > 0
+    assert report["ingest"]["chunks_merged"] > 0
+    for phase in ("dedup", "retrieval", "compose"):
+        assert report[phase]["exact"]["calls"] > 0
+    assert {"p50_ms", "p95_ms", "p99_ms", "per_sec"} <= set(report["mmr"])
+    assert report["peak_rss_mb"] > 0
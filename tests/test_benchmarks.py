@@ -0,0 +1,72 @@
+"""Timing regressions for the hot paths; see "Benchmarks" in context_engine/README.md for baselines."""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from context_engine import reducers, tokens
+from context_engine.bench import synthetic_pairs, synthetic_queries
+from context_engine.embeddings import HashEmbedder
+from context_engine.engine import ContextEngine
+from context_engine.retrieval import hybrid_search
+
+pytestmark = pytest.mark.benchmark
+
+SIZES = [500, 5000]
+fast = pytest.mark.benchmark(max_time=0.25, min_rounds=5)
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda n: f"{n}chunks")
+def engine(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp(f"bench{request.param}") / "ctx.db"
+    eng = ContextEngine(db_path=str(path), embedder=HashEmbedder(), vector_search="exact", compose_cache_size=0)
+    eng.update_memory_many(synthetic_pairs(request.param // 2, seed=0))
+    yield eng
+    eng.close()
+
+
+@fast
+def test_hybrid_search(benchmark, engine):
+    dl = engine.store.load_ledger()
+    queries = iter(synthetic_queries(100_000, seed=1))
+    hits = benchmark(lambda: hybrid_search(next(queries), dl, None, engine.embedder, k=5,
+                                           store=engine.store, vindex=engine.vindex))
+    assert len(hits) == 5
+
+
+@fast
+def test_compose_context(benchmark, engine):
+    queries = iter(synthetic_queries(100_000, seed=2))
+    assert benchmark(lambda: engine.compose_context(next(queries)))
+
+
+@fast
+def test_load_fs_chunks(benchmark, engine):
+    assert len(benchmark(engine.store.load_fs_chunks)) == engine.store.count_fs()
+
+
+@fast
+def test_update_memory_dedup(benchmark, engine):
+    user, assistant = next(synthetic_pairs(1, seed=0))
+    # the first exchange of the corpus again: every summary merges
+    result = benchmark(engine.update_memory, user, assistant)
+    assert all(c["merged"] for c in result["chunks"])
+
+
+@fast
+def test_len_tokens_uncached(benchmark):
+    texts = [u + "\n" + a for u, a in synthetic_pairs(64, seed=3)]
+    benchmark.pedantic(lambda: [tokens.len_tokens(t) for t in texts], setup=tokens._counts.clear, rounds=20)
+
+
+@fast
+def test_cap_to_tokens(benchmark):
+    text = " ".join(u + " " + a for u, a in synthetic_pairs(200, seed=4))
+    benchmark.pedantic(tokens.cap_to_tokens, args=(text, 300), setup=tokens._counts.clear, rounds=20)
+
+
+@fast
+def test_densify(benchmark):
+    pairs = list(synthetic_pairs(40, seed=5))
+    existing = "\n".join(u for u, _ in pairs[:20])
+    incoming = "\n".join(a for _, a in pairs[20:])
+    assert benchmark(reducers.densify, existing, incoming, 160)
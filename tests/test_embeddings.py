@@ -0,0 +1,85 @@
+import numpy as np
+from context_engine.embeddings import HashEmbedder, CachedEmbedder
+from context_engine.store import Store
+
+
+class CountingEmbedder(HashEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.seen = []
+
+    def encode(self, texts):
+        self.seen.extend(texts)
+        return super().encode(texts)
+
+
+def test_cached_embedder_memory_then_store(tmp_path):
+    store = Store(str(tmp_path / "ctx.db"))
+    inner = CountingEmbedder()
+    emb = CachedEmbedder(inner, store, max_items=2)
+    first = emb.encode(["a", "b", "a"])
+    assert inner.seen == ["a", "b"]
+    assert np.allclose(first, HashEmbedder().encode(["a", "b", "a"]), atol=1e-6)
+    emb.encode(["b"])
+    assert emb.stats() == {"hits_memory": 1, "hits_store": 0, "misses": 2}
+    # a fresh wrapper (new process) is served by the SQLite table
+    again = CachedEmbedder(inner, store)
+    assert np.allclose(again.encode(["a", "b"]), first[:2])
+    assert inner.seen == ["a", "b"] and again.stats()["hits_store"] == 2
+
+
+def test_openai_embedder_batches_and_retries():
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from context_engine.embeddings import OpenAIEmbedder
+
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests_seen.append(body["input"])
+            if len(requests_seen) == 1:
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+            data = [{"index": i, "embedding": [float(len(t)), 1.0]} for i, t in enumerate(body["input"])]
+            payload = json.dumps({"data": list(reversed(data))}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        emb = OpenAIEmbedder(model="test", api_key="k", base_url=f"http://127.0.0.1:{server.server_port}/v1",
+                             max_batch_size=3, concurrency=2, backoff=0.01)
+        texts = ["x" * n for n in range(1, 9)]
+        vecs = emb.encode(texts)
+    finally:
+        server.shutdown()
+    assert vecs[:, 0].tolist() == [float(n) for n in range(1, 9)]
+    # 8 inputs in batches of <= 3, plus the one 429 that was retried
+    assert len(requests_seen) == 4 and max(len(r) for r in requests_seen) <= 3
+
+
+def test_local_embedder_semantic_overlap():
+    from context_engine.embeddings import LocalEmbedder
+    emb = LocalEmbedder(dim=128)
+    vecs = emb.encode(["Add loader with progress bar", "add a progress loader", "Fix authentication bug", ""])
+    assert vecs.shape == (4, 128) and vecs.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vecs[:3], axis=1), 1.0, atol=1e-5)
+    assert vecs[0] @ vecs[1] > 0.4 > vecs[0] @ vecs[2]
+    # batch-independent and deterministic
+    assert np.allclose(LocalEmbedder(dim=128).encode(["add a progress loader"])[0], vecs[1], atol=1e-6)
+    # a batch of only texts shorter than the smallest char n-gram
+    for texts in (["hi"], ["ok"], [""], ["", "a"]):
+        assert emb.encode(texts).shape == (len(texts), 128)
+    assert np.allclose(emb.encode(["hi"])[0], emb.encode(["hi", "longer text"])[0], atol=1e-6)
@@ -1,13 +1,16 @@
+import pytest
 from context_engine.engine import ContextEngine
 from context_engine.embeddings import HashEmbedder
 from context_engine.tokens import len_tokens
 
 
-def test_engine_update_and_compose(tmp_path):
+@pytest.mark.parametrize("vector_search", ["hnsw", "exact"])
+def test_engine_update_and_compose(tmp_path, vector_search):
     db = tmp_path / "ctx.db"
-    eng = ContextEngine(db_path=str(db), embedder=HashEmbedder(), dl_cap_tokens=50, budget_tokens=200, es_tokens=40)
-    eng.update_memory("decide: use Astro\nWe chose Astro; add loader", "Done; todo: add confetti")
-    eng.update_memory("decide: use Astro\nWe chose Astro; add loader", "Done; todo: add confetti")
+    eng = ContextEngine(db_path=str(db), embedder=HashEmbedder(), dl_cap_tokens=50, budget_tokens=200, es_tokens=40,
+                        vector_search=vector_search)
+    first = eng.update_memory("decide: use Astro\nWe chose Astro; add loader", "Done; todo: add confetti")
+    second = eng.update_memory("decide: use Astro\nWe chose Astro; add loader", "Done; todo: add confetti")
     stats = eng.stats()
     assert stats["dl_tokens"] <= 50
     # AC window size
@@ -16,6 +19,214 @@ def test_engine_update_and_compose(tmp_path):
     # FS dedupe -> only two chunks
     fs_chunks = eng.store.load_fs_chunks()
     assert len(fs_chunks) == 2
+    assert not any(c["merged"] for c in first["chunks"])
+    assert [c["id"] for c in second["chunks"]] == [c["id"] for c in first["chunks"]]
+    assert all(c["merged"] for c in second["chunks"])
     # compose context under budget
     ctx = eng.compose_context("Improve loader feedback")
     assert len_tokens(ctx) <= 200
+
+
+def test_hot_state_cache_and_staleness(tmp_path, monkeypatch):
+    db = str(tmp_path / "ctx.db")
+    eng = ContextEngine(db_path=db, vector_search="exact")
+    eng.update_memory("decide: use Astro", "ok")
+    calls = []
+    monkeypatch.setattr(eng.store, "load_ledger", lambda: calls.append(1))
+    eng.compose_context("astro")
+    eng.stats()
+    assert calls == []
+    monkeypatch.undo()
+    # a second engine writing to the same DB invalidates the first one's copy
+    other = ContextEngine(db_path=db, vector_search="exact")
+    other.update_memory("decide: add loader", "ok")
+    assert eng.stats()["ac_pairs"] == 2
+    assert "add loader" in eng.compose_context("loader")
+
+
+def test_update_memory_many_bulk_import(tmp_path):
+    import json
+    from context_engine.importers import iter_pairs
+    history = tmp_path / "history.json"
+    items = [{"prompt": f"decide: option {i % 5}\nTopic {i % 5} details", "response": f"Ack topic {i % 5}"}
+             for i in range(40)]
+    history.write_text(json.dumps(items + [{"prompt": "no response"}]))
+    eng = ContextEngine(db_path=str(tmp_path / "ctx.db"), embedder=HashEmbedder(), vector_search="exact",
+                        dl_cap_tokens=60)
+    report = eng.update_memory_many(iter_pairs(str(history)), batch_size=16)
+    assert report["pairs"] == 40
+    # five distinct exchanges repeated: everything after the first round merges
+    assert report["chunks_new"] == 10 and report["chunks_merged"] == 70
+    assert eng.stats()["fs_chunks"] == 10
+    assert eng.store.load_ledger().decisions == [f"option {i}" for i in range(5)]
+    assert len(eng.store.load_ac()) == 4 and report["pairs_per_sec"] > 0
+
+
+def test_compose_cache_invalidated_by_writes(tmp_path):
+    eng = ContextEngine(db_path=str(tmp_path / "ctx.db"), vector_search="exact", compose_cache_size=2)
+    eng.update_memory("decide: use Astro", "ok")
+    first = eng.compose_context("loader  feedback")
+    assert eng.compose_context("loader feedback") is first
+    eng.update_memory("decide: add loader", "ok")
+    second = eng.compose_context("loader feedback")
+    assert second != first and "add loader" in second
+    stats = eng.stats()["compose_cache"]
+    assert stats["hits"] == 1 and stats["misses"] == 2 and stats["size"] == 2
+
+
+def test_compose_stream_stops_when_budget_spent(tmp_path, monkeypatch):
+    from context_engine import retrieval
+    eng = ContextEngine(db_path=str(tmp_path / "ctx.db"), embedder=HashEmbedder(), vector_search="exact",
+                        budget_tokens=400, pack=False)
+    eng.update_memory("We chose Astro for the site; add a loader", "Done; todo: add confetti")
+    sections = list(eng.compose_stream("loader"))
+    assert sections[0].startswith("user: We chose Astro") and "todos" in sections[1] and len(sections) > 2
+    assert "\n".join(sections) == eng.compose_context("loader")
+    assert len_tokens("\n".join(sections)) <= 400
+    # AC alone fills a tiny budget: DL and retrieval are never produced
+    calls = []
+    monkeypatch.setattr(retrieval, "hybrid_search", lambda *a, **k: calls.append(1) or [])
+    eng.budget_tokens = 8
+    sections = list(eng.compose_stream("loader"))
+    assert len(sections) == 1 and len_tokens(sections[0]) <= 8 and calls == []
+
+
+def test_packed_compose_prefers_value_per_token(tmp_path):
+    import numpy as np
+    from context_engine import packer
+    items = [packer.PackItem("chunk", "a", 60, 1.0), packer.PackItem("chunk", "b", 50, 0.9),
+             packer.PackItem("chunk", "c", 50, 0.9)]
+    # greedy by order would keep "a" alone; the knapsack fits the two smaller units
+    assert packer.pack(items, 100) == [1, 2]
+    assert packer._pack_greedy(np.array([60, 50, 50]), np.array([1.0, 0.9, 0.9]), 100) == [1, 2]
+    eng = ContextEngine(db_path=str(tmp_path / "ctx.db"), embedder=HashEmbedder(), vector_search="exact",
+                        budget_tokens=120)
+    eng.update_memory("constraint: keep bundle under 200kb\nWe chose Astro; add a loader", "Done; todo: add confetti")
+    eng.update_memory("Long notes " + "lorem ipsum dolor " * 80, "ok")
+    ctx = eng.compose_context("bundle size")
+    assert len_tokens(ctx) <= 120
+    # the long turn does not fit, so whole smaller units fill the budget instead of half of it
+    assert "lorem" not in ctx and "keep bundle under 200kb" in ctx
+
+
+def test_compact_merges_evicts_and_shrinks_vectors(tmp_path):
+    import os, time
+    db = str(tmp_path / "ctx.db")
+    # nothing merges at ingest, so repeats pile up as separate chunks
+    eng = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact", dedup_threshold=1.01)
+    for _ in range(3):
+        eng.update_memory("Use Astro for the marketing site", "Added a loader to the router")
+    eng.update_memory("Unrelated billing webhook retries", "Retry three times with backoff")
+    assert eng.stats()["fs_chunks"] == 8
+    eng.compose_context("Astro marketing site")
+    eng._flush_hits()
+    assert sum(hits for hits, _ in eng.store.chunk_stats().values()) == 8
+    stale = [c.id for c in eng.store.load_fs_chunks() if "billing" in c.text]
+    eng.store.set_chunk_stats({cid: (0, time.time() - 90 * 86400) for cid in stale})
+    size = os.path.getsize(eng.store.vec_path)
+    report = eng.compact(threshold=0.95)
+    assert report["clusters"] == 2 and report["merged"] == 4 and report["evicted"] == 2
+    assert report["chunks_after"] == 2 and report["vec_rows_dropped"] == 8
+    assert os.path.getsize(eng.store.vec_path) < size
+    assert "Astro" in eng.compose_context("Astro marketing site")
+    eng.close()
+    again = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact")
+    hits = again.vindex.search(again.embedder.encode(["Use Astro for the marketing site"])[0], 2)
+    assert len(hits) == 2 and again.stats()["fs_chunks"] == 2
+    again.close()
+
+
+def test_compacted_default_session_and_numeric_session_keep_their_vectors(tmp_path):
+    db = str(tmp_path / "ctx.db")
+    default = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact", dedup_threshold=1.01)
+    for _ in range(2):
+        default.update_memory("Use Astro for the marketing site", "Added a loader")
+    # the default session moves to epoch 1, whose file once shared session "1"'s epoch-0 name
+    assert default.compact(threshold=0.95)["vec_rows_dropped"] > 0
+    other = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact", session_id="1",
+                          dedup_threshold=1.01)
+    other.update_memory("Billing webhook retries", "Retry three times")
+    other.update_memory("Billing webhook retries", "Retry three times")
+    assert other.store.vec_path != default.store.vec_path
+    assert other.compact(threshold=0.95)["vec_rows_dropped"] > 0
+    for eng, n in ((default, 2), (other, 2)):
+        assert eng.store.vector_stats()["live"] == n
+        assert all(c.vec is not None for c in eng.store.load_fs_chunks())
+    default.close()
+    other.close()
+    reopened = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact")
+    assert all(c.vec is not None for c in reopened.store.load_fs_chunks()) and reopened.stats()["fs_chunks"] == 2
+
+
+def test_write_behind_reads_see_pending_writes(tmp_path):
+    eng = ContextEngine(db_path=str(tmp_path / "ctx.db"), embedder=HashEmbedder(), vector_search="exact",
+                        write_behind=60)
+    eng.update_memory("decide: use Astro", "ok")
+    eng.update_memory("Add a loader to the Astro site", "Done")
+    assert eng.store._writer.in_transaction
+    assert eng.stats()["ac_pairs"] == 2 and eng.stats()["fs_chunks"] == 4
+    assert len(eng.store.load_ac()) == 4 and "Astro" in eng.compose_context("Astro")
+    eng.close()
+
+
+def test_compose_does_not_wait_on_an_open_batch(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    db = str(tmp_path / "ctx.db")
+    eng = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact")
+    eng.update_memory("decide: use Astro", "ok")
+    with ThreadPoolExecutor(1) as pool, eng.store.batch():
+        # a fresh query embeds; caching its vector must not block on the held write lock
+        assert "Astro" in pool.submit(eng.compose_context, "a brand new Astro question").result(timeout=2)
+    eng.close()
+    reopened = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact")
+    reopened.compose_context("a brand new Astro question")
+    assert reopened.stats()["embedding_cache"]["misses"] == 0
+    reopened.close()
+
+
+def test_ingest_during_compaction_stays_in_the_index(tmp_path):
+    import threading
+    import time
+    eng = ContextEngine(db_path=str(tmp_path / "ctx.db"), embedder=HashEmbedder(), vector_search="hnsw")
+    eng.update_memory("decide: use Astro", "ok")
+    rebuild, ingest = eng.vindex.rebuild, threading.Thread(target=eng.update_memory, args=("add a loader", "done"))
+
+    def slow_rebuild(items):
+        items = list(items)
+        ingest.start()
+        time.sleep(0.3)
+        rebuild(items)
+    eng.vindex.rebuild = slow_rebuild
+    eng.compact()
+    ingest.join()
+    assert len(eng.vindex) == eng.stats()["fs_chunks"] == 4
+    eng.close()
+
+
+def test_baseline_database_is_reembedded_for_the_default_embedder(tmp_path):
+    import sqlite3
+    import numpy as np
+    db = str(tmp_path / "ctx.db")
+    # the schema and 64-dim HashEmbedder BLOBs the first release wrote
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE transcripts(turn_id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT, text TEXT, ts TEXT)")
+    conn.execute("CREATE TABLE fs_chunks(id TEXT PRIMARY KEY, type TEXT, tags TEXT, text TEXT, src_turn INTEGER, vec BLOB)")
+    conn.execute("CREATE TABLE ledger(id INTEGER PRIMARY KEY, yaml TEXT)")
+    conn.execute("CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO meta VALUES('ac', '[]')")
+    for i, text in enumerate(["We chose Astro for the site", "Loader shows a progress bar"]):
+        vec = HashEmbedder().encode([text])[0].astype(np.float32).tobytes()
+        conn.execute("INSERT INTO fs_chunks VALUES(?,?,?,?,?,?)", (f"c{i}", "extractive", "", text, 1, vec))
+    conn.commit()
+    conn.close()
+    eng = ContextEngine(db_path=db)
+    assert eng.stats()["vectors"]["dim"] == 256 and eng.stats()["fs_chunks"] == 2
+    assert "Astro" in eng.compose_context("which framework did we choose for the site?")
+    eng.update_memory("Add confetti to the loader", "Done")
+    eng.close()
+    # the embedder is recorded now: an explicit one re-embeds, the default then refuses to guess
+    eng = ContextEngine(db_path=db, embedder=HashEmbedder())
+    assert eng.stats()["vectors"]["dim"] == 64 and "Astro" in eng.compose_context("Astro")
+    eng.close()
+    with pytest.raises(ValueError, match="HashEmbedder"):
+        ContextEngine(db_path=db)
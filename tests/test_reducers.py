@@ -11,3 +11,20 @@ def test_densify_and_condenser():
     assert T.len_tokens(condensed) <= 5
     final = R.final_budget_cut(condensed + " more words", target_tokens=5)
     assert T.len_tokens(final) <= 5
+
+def test_len_tokens_many_matches_and_caches():
+    texts = ["alpha beta", "gamma <|endoftext|> delta", "alpha beta"]
+    assert T.len_tokens_many(texts) == [T.len_tokens(t) for t in texts]
+    T.warm_up()
+    if T.tiktoken is not None:
+        assert T.get_encoder() is T.get_encoder("gpt-4o-mini")
+
+def test_cap_to_tokens_exact_boundary():
+    text = "The quick brown fox jumps over the lazy dog. " * 20 + "naïve café ✓ done"
+    for target in (1, 7, 50, 150):
+        capped = T.cap_to_tokens(text, target)
+        assert text.startswith(capped)
+        assert T.len_tokens(capped) <= target
+        if T.tiktoken is not None:
+            assert T.len_tokens(capped) >= target - 1
+    assert T.cap_to_tokens("short", 10) == "short"
@@ -1,3 +1,4 @@
+import numpy as np
 from context_engine.embeddings import HashEmbedder
 from context_engine.models import FSChunk, DecisionLedger
 from context_engine import retrieval
@@ -19,3 +20,49 @@ def test_hybrid_search_mmr():
     assert len(res) == 2
     ids = {c.id for c in res}
     assert ids <= {"1", "2", "3"}
+
+def test_mmr_select_matches_greedy_walk():
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(40, 16))
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    q = vecs[:5].mean(axis=0)
+    # reference: the per-candidate walk hybrid_search used before
+    expected = [0]
+    for i in range(1, len(vecs)):
+        max_sim = max(vecs[i] @ vecs[j] for j in expected)
+        if 0.7 * (vecs[i] @ q) - 0.3 * max_sim > 0:
+            expected.append(i)
+        if len(expected) >= 6:
+            break
+    assert retrieval.mmr_select(q, vecs, 6, 0.7) == expected
+
+
+def test_tag_filtered_retrieval(tmp_path, monkeypatch):
+    import sqlite3
+    from context_engine.engine import ContextEngine
+    from context_engine.store import Store
+    db = str(tmp_path / "ctx.db")
+    eng = ContextEngine(db_path=db, embedder=HashEmbedder(), vector_search="exact")
+    eng.update_memory("Fix the loader spinner in src/app.ts #ui", "Spinner now shows during fetch")
+    eng.update_memory("Speed up the loader query in lib/db.py", "Added an index for the loader query")
+    eng.update_memory("Tune the loader cache", "Cache the loader results for a minute")
+    assert eng.store.tag_counts() == {"src/app.ts": 2, "ui": 2, "lib/db.py": 2}
+    dl = eng.store.load_ledger()
+    scoped = retrieval.hybrid_search("loader", dl, None, eng.embedder, k=8, store=eng.store, vindex=eng.vindex,
+                                     tags=["lib/db.py"])
+    assert len(scoped) == 2 and all("lib/db.py" in c.tags for c in scoped)
+    # session-wide statistics: a scoped chunk scores as it would unscoped
+    full, part = eng.store.bm25_scores(["loader", "query"]), eng.store.bm25_scores(["loader", "query"], tags=["ui"])
+    assert part and part == {cid: full[cid] for cid in eng.store.tagged_chunk_ids(["ui"]) if cid in full}
+    # only the subset's rows are read: the session-wide vector index is never searched
+    monkeypatch.setattr(eng.vindex, "search", lambda *a, **k: 1 / 0)
+    chunks = [it.ref for it in eng.pack_items("loader", tags=["ui", "src/app.ts"]) if it.kind == "chunk"]
+    assert len(chunks) == 2 and all("ui" in c.tags for c in chunks)
+    assert eng.compose_context("loader", tags=["ui"]) != eng.compose_context("loader", tags=["lib/db.py"])
+    assert retrieval.hybrid_search("loader", dl, None, eng.embedder, store=eng.store, vindex=eng.vindex,
+                                   tags=["nope"]) == []
+    eng.close()
+    # databases from before the table existed are backfilled from fs_chunks.tags
+    with sqlite3.connect(db) as conn:
+        conn.execute("DROP TABLE chunk_tags")
+    assert Store(db, str(tmp_path / "indexes")).tagged_chunk_ids(["ui"]) != []
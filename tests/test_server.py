@@ -0,0 +1,65 @@
+import asyncio
+import http.client
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from context_engine.embeddings import HashEmbedder
+from context_engine.server import ContextServer, EnginePool
+
+
+def test_server_ingest_compose_stats_per_session(tmp_path):
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = ContextServer(str(tmp_path / "ctx.db"), embedder=HashEmbedder(), vector_search="exact", max_engines=1)
+    srv = asyncio.run_coroutine_threadsafe(server.start(port=0), loop).result()
+    conn = http.client.HTTPConnection("127.0.0.1", srv.sockets[0].getsockname()[1])
+
+    def call(method, path, body=None):
+        conn.request(method, path, body=json.dumps(body) if body is not None else None)
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read())
+
+    try:
+        status, out = call("POST", "/ingest", {"session": "a", "user": "decide: use Astro", "assistant": "ok"})
+        assert status == 200 and len(out["chunks"]) == 2
+        # same keep-alive connection, another session; max_engines=1 closes the idle one
+        assert call("POST", "/ingest", {"session": "b", "user": "decide: use Vue", "assistant": "ok"})[0] == 200
+        assert "use Vue" not in call("POST", "/compose", {"session": "a", "next": "framework"})[1]["context"]
+        assert call("GET", "/stats?session=b")[1]["fs_chunks"] == 2
+        assert call("POST", "/compose", {"session": "a"})[0] == 400
+        assert call("GET", "/nope")[0] == 404
+    finally:
+        conn.close()
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_pool_never_closes_an_engine_acquired_during_eviction():
+    release = threading.Event()
+
+    class Engine:
+        def __init__(self, session):
+            self.session, self.closed = session, False
+
+        def close(self):
+            if self.session == "a":
+                release.wait(5)
+            self.closed = True
+
+    async def run():
+        pool = EnginePool(Engine, ThreadPoolExecutor(2), max_engines=1)
+        pool._engines.update(a=Engine("a"), b=Engine("b"))
+        opening = asyncio.ensure_future(pool.acquire("c"))
+        while "c" not in pool._engines or "a" in pool._engines:
+            await asyncio.sleep(0.01)
+        # "a" is closing; "b" is picked up before eviction moves on to it
+        b = await pool.acquire("b")
+        release.set()
+        await opening
+        assert not b.closed and set(pool._engines) == {"b", "c"}
+        pool.release("b")
+        pool.release("c")
+        await pool.close()
+        pool.executor.shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,273 @@
+import time
+from context_engine.store import Store
+from context_engine.models import FSChunk
+from context_engine import bm25
+
+
+def test_bm25_index_incremental(tmp_path):
+    store = Store(str(tmp_path / "ctx.db"))
+    a = FSChunk(id="a", type="extractive", text="astro loader progress", src_turn=1)
+    b = FSChunk(id="b", type="extractive", text="fix auth bug", src_turn=2)
+    store.upsert_fs_chunk(a)
+    store.upsert_fs_chunk(b)
+    scores = store.bm25_scores(["loader"])
+    assert set(scores) == {"a"}
+    # merged chunk replaces its postings and keeps doc stats consistent
+    a.text = "astro loader confetti"
+    store.upsert_fs_chunk(a)
+    assert "a" in store.bm25_scores(["confetti"])
+    assert store.bm25_scores(["progress"]) == {}
+    mem = bm25.MemoryIndex({c.id: bm25.doc_text(c.text, c.tags) for c in store.load_fs_chunks()})
+    terms = ["astro", "auth", "loader"]
+    assert store.bm25_scores(terms) == mem.bm25_scores(terms)
+    # reopening an existing DB keeps the index intact
+    assert Store(str(tmp_path / "ctx.db")).bm25_scores(terms) == mem.bm25_scores(terms)
+
+
+def test_vectors_memory_mapped(tmp_path):
+    import sqlite3
+    import numpy as np
+    db = str(tmp_path / "ctx.db")
+    store = Store(db)
+    v1, v2 = np.eye(4, dtype=np.float32)[:2]
+    store.upsert_fs_chunk(FSChunk(id="a", type="extractive", text="x", src_turn=1, vec=v1))
+    store.upsert_fs_chunk(FSChunk(id="b", type="extractive", text="y", src_turn=1, vec=v2))
+    store.upsert_fs_chunk(FSChunk(id="a", type="extractive", text="x", src_turn=1, vec=(v1 + v2) / 2))
+    mat = store.vector_matrix()
+    assert isinstance(mat, np.memmap) and mat.shape == (3, 4)
+    assert store.live_rows().tolist() == [False, True, True]
+    assert np.allclose(store.vector("a"), (v1 + v2) / 2)
+    # a legacy BLOB vector is migrated into the file on open
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO fs_chunks(id,type,tags,text,src_turn,vec) VALUES('c','extractive','','z',2,?)",
+                 (np.ones(4, dtype=np.float32).tobytes(),))
+    conn.commit()
+    reopened = Store(db)
+    assert reopened.count_vectors() == 3
+    assert np.allclose(reopened.vector("c"), 1.0)
+    assert {c.id: c.vec.tolist() for c in reopened.load_fs_chunks()}["b"] == v2.tolist()
+    # chunks are loaded with their current vector, or none
+    reopened.upsert_fs_chunk(FSChunk(id="d", type="extractive", text="w", src_turn=3))
+    loaded = {c.id: c.vec for c in reopened.load_fs_chunks()}
+    assert np.allclose(loaded["a"], (v1 + v2) / 2) and loaded["d"] is None
+    assert [c.id for c in reopened.get_fs_chunks(["d", "a", "nope"])] == ["d", "a"]
+
+
+def test_quantized_vectors_convert_and_score(tmp_path):
+    import os
+    import numpy as np
+    from context_engine import quantize
+    from context_engine.embeddings import HashEmbedder
+    from context_engine.vector_index import ExactIndex
+    db = str(tmp_path / "ctx.db")
+    vecs = HashEmbedder().encode([f"note {i} about topic {i % 7}" for i in range(200)])
+    store = Store(db)
+    store.upsert_fs_chunks([FSChunk(id=str(i), type="extractive", text="t", src_turn=i, vec=v)
+                            for i, v in enumerate(vecs)])
+    f32_bytes = os.path.getsize(store.vec_path)
+    store.close()
+    # reopening with a dtype converts the session's file; later opens keep it
+    for dtype, ratio in (("float16", 2), ("int8", 4)):
+        store = Store(db, vec_dtype=dtype)
+        assert store.vec_dtype == dtype and store.vec_path.endswith(quantize.SUFFIX[dtype])
+        assert os.path.getsize(store.vec_path) <= f32_bytes / ratio + 4 * len(vecs)
+        assert np.allclose(store.vector("5"), vecs[5], atol=1e-2)
+        exact = ExactIndex(store).search_many(vecs[:20], 5)
+        assert [hits[0][0] for hits in exact] == [str(i) for i in range(20)]
+        store.close()
+    assert Store(db).vec_dtype == "int8"
+    report = quantize.recall(vecs, "int8", k=5)
+    assert report["recall_at_k"] > 0.9 and report["mean_cosine"] > 0.999
+
+
+def test_exact_search_scores_in_blocks(tmp_path, monkeypatch):
+    import numpy as np
+    from context_engine import vector_index
+    from context_engine.embeddings import HashEmbedder
+    store = Store(str(tmp_path / "ctx.db"))
+    vecs = HashEmbedder().encode([f"note {i} about topic {i % 7}" for i in range(300)])
+    store.upsert_fs_chunks([FSChunk(id=str(i), type="extractive", text="t", src_turn=i, vec=v)
+                            for i, v in enumerate(vecs)])
+    store.delete_fs_chunks([str(i) for i in range(0, 300, 3)])
+    live = [i for i in range(300) if i % 3]
+    # 40 queries x 64 rows per block: the matrix is scored in five blocks
+    monkeypatch.setattr(vector_index, "SCORE_BLOCK", 40 * 64)
+    hits = vector_index.ExactIndex(store).search_many(vecs[:40], 7)
+    for q, found in zip(vecs[:40], hits):
+        scores = vecs[live] @ q
+        want = [str(live[i]) for i in np.argsort(-scores)[:7]]
+        assert [cid for cid, _ in found] == want
+        assert np.allclose([s for _, s in found], np.sort(scores)[::-1][:7], atol=1e-5)
+    assert vector_index.ExactIndex(store).search(vecs[1], 400)[0][0] == "1"
+    store.close()
+
+
+def test_batch_commits_once_and_rolls_back(tmp_path):
+    import sqlite3
+    import pytest
+    db = str(tmp_path / "ctx.db")
+    store = Store(db)
+    other = sqlite3.connect(db)
+    with store.batch():
+        store.upsert_fs_chunk(FSChunk(id="a", type="extractive", text="x", src_turn=1))
+        store.upsert_fs_chunk(FSChunk(id="b", type="extractive", text="y", src_turn=1))
+        assert other.execute("SELECT COUNT(*) FROM fs_chunks").fetchone()[0] == 0
+    assert other.execute("SELECT COUNT(*) FROM fs_chunks").fetchone()[0] == 2
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            store.upsert_fs_chunk(FSChunk(id="c", type="extractive", text="z", src_turn=2))
+            raise RuntimeError("boom")
+    assert store.count_fs() == 2
+    # write-behind holds commits until flush
+    lazy = Store(db, write_behind=3600)
+    lazy.upsert_fs_chunk(FSChunk(id="d", type="extractive", text="w", src_turn=3))
+    assert other.execute("SELECT COUNT(*) FROM fs_chunks").fetchone()[0] == 2
+    lazy.flush()
+    assert other.execute("SELECT COUNT(*) FROM fs_chunks").fetchone()[0] == 3
+    # the background flush commits a backlog no later write picks up
+    timed = Store(db, write_behind=0.05)
+    timed.upsert_fs_chunk(FSChunk(id="e", type="extractive", text="v", src_turn=4))
+    deadline = time.monotonic() + 5
+    while other.execute("SELECT COUNT(*) FROM fs_chunks").fetchone()[0] < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert other.execute("SELECT COUNT(*) FROM fs_chunks").fetchone()[0] == 4
+    timed.close()
+
+
+def test_ledger_entries_collapse_and_trim(tmp_path):
+    from context_engine.models import DecisionLedger
+    store = Store(str(tmp_path / "ctx.db"))
+    store.merge_ledger(DecisionLedger(decisions=["use Astro"], todos=["add loader"], ids={"repo": "site"}))
+    store.merge_ledger(DecisionLedger(decisions=["use Astro"], ids={"repo": "site-v2"}))
+    dl = store.load_ledger()
+    assert dl.decisions == ["use Astro"] and dl.ids == {"repo": "site-v2"}
+    (hits,) = store.conn.execute("SELECT hit_count FROM ledger_entries WHERE key='use Astro'").fetchone()
+    assert hits == 2
+    store.merge_ledger(DecisionLedger(decisions=[f"decision number {i}" for i in range(30)]))
+    store.trim_ledger(60)
+    dl = store.load_ledger()
+    assert store.ledger_tokens() <= 60
+    assert dl.decisions[-1] == "decision number 29" and "add loader" not in dl.todos
+    assert dl.ids == {"repo": "site-v2"}
+
+
+def test_sessions_are_isolated_and_legacy_db_migrates(tmp_path):
+    import sqlite3
+    import numpy as np
+    from context_engine.models import DecisionLedger, Turn
+    db = str(tmp_path / "ctx.db")
+    # a database written before sessions existed
+    conn = sqlite3.connect(db)
+    conn.executescript("""
+        CREATE TABLE transcripts(turn_id INTEGER PRIMARY KEY AUTOINCREMENT, role TEXT, text TEXT, ts TEXT);
+        CREATE TABLE fs_chunks(id TEXT PRIMARY KEY, type TEXT, tags TEXT, text TEXT, src_turn INTEGER, vec BLOB);
+        CREATE TABLE ledger_entries(field TEXT, key TEXT, value TEXT, token_count INTEGER, first_seen TEXT,
+                                    hit_count INTEGER, seq INTEGER, PRIMARY KEY(field, key));
+        CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE bm25_postings(term TEXT, chunk_id TEXT, tf INTEGER, PRIMARY KEY(term, chunk_id)) WITHOUT ROWID;
+        INSERT INTO transcripts(role,text,ts) VALUES('user','old turn','2024-01-01T00:00:00');
+        INSERT INTO fs_chunks VALUES('old','extractive','','astro loader',1,NULL);
+        INSERT INTO ledger_entries VALUES('decisions','use Astro','use Astro',4,'2024',1,1);
+        INSERT INTO meta VALUES('ac','[]'),('state_version','7'),('fs_version','3');
+    """)
+    conn.commit()
+    default = Store(db)
+    assert default.versions() == (7, 3)
+    assert [t.text for t in default.last_turns(5)] == ["old turn"]
+    assert default.load_ledger().decisions == ["use Astro"]
+    assert set(default.bm25_scores(["loader"])) == {"old"}
+    other = Store(db, session_id="user/42")
+    assert other.last_turns(5) == [] and other.count_fs() == 0 and other.load_ledger().decisions == []
+    other.append_turn(Turn(role="user", text="new turn"))
+    other.merge_ledger(DecisionLedger(decisions=["use Vue"]))
+    other.upsert_fs_chunk(FSChunk(id="new", type="extractive", text="vue loader", src_turn=2,
+                                  vec=np.ones(3, dtype=np.float32)))
+    assert set(other.bm25_scores(["loader"])) == {"new"}
+    assert other.get_fs_chunks(["old", "new"])[0].id == "new" and other.count_vectors() == 1
+    assert set(default.bm25_scores(["loader"])) == {"old"} and default.count_vectors() == 0
+    assert [t.text for t in default.last_turns(5)] == ["old turn"]
+    assert default.load_ledger().decisions == ["use Astro"]
+    assert default.sessions() == ["default", "user/42"]
+
+
+def test_store_shared_across_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    store = Store(str(tmp_path / "ctx.db"))
+    store.upsert_fs_chunk(FSChunk(id="a", type="extractive", text="x", src_turn=1))
+    with store.batch():
+        store.upsert_fs_chunk(FSChunk(id="b", type="extractive", text="y", src_turn=1))
+        assert store.count_fs() == 2
+        # other threads read the committed snapshot without waiting for the writer
+        with ThreadPoolExecutor(4) as pool:
+            assert list(pool.map(lambda _: store.count_fs(), range(8))) == [1] * 8
+    # writes from many threads are serialized through the one writer
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: store.upsert_fs_chunk(
+            FSChunk(id=f"t{i}", type="extractive", text=f"t{i}", src_turn=i, vec=np.full(4, i, dtype=np.float32))),
+            range(64)))
+    assert store.count_fs() == 66 and store.count_vectors() == 64
+    assert all(store.vector(f"t{i}")[0] == i for i in range(64))
+    store.close()
+
+
+def test_two_stores_see_each_others_vectors(tmp_path):
+    import threading
+    import numpy as np
+    db = str(tmp_path / "ctx.db")
+    a, b = Store(db), Store(db)
+    vec = lambda i: np.full(4, i, dtype=np.float32)
+    chunk = lambda cid, i: FSChunk(id=cid, type="extractive", text=cid, src_turn=1, vec=vec(i))
+    # b opened with no vectors at all
+    a.upsert_fs_chunk(chunk("first", 1))
+    assert b.vector("first")[0] == 1
+    # rows a has appended but not committed are not mapped yet, and not skipped later
+    with a.batch():
+        a.upsert_fs_chunk(chunk("pending", 2))
+        assert b.vector("pending") is None and len(b.vector_matrix()) == 2
+    assert b.vector("pending")[0] == 2
+    # an append waits for the other Store's open transaction instead of claiming its rows
+    with a.batch():
+        a.upsert_fs_chunk(chunk("from_a", 3))
+        writer = threading.Thread(target=b.upsert_fs_chunk, args=(chunk("from_b", 4),))
+        writer.start()
+        time.sleep(0.2)
+    writer.join()
+    c = Store(db)
+    assert [c.vector(cid)[0] for cid in ("first", "pending", "from_a", "from_b")] == [1, 2, 3, 4]
+    assert a.vector("from_b")[0] == 4 and b.vector("from_a")[0] == 3
+    for s in (a, b, c):
+        s.close()
+
+
+def test_write_behind_reads_wait_for_other_threads_batches(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    store = Store(str(tmp_path / "ctx.db"), write_behind=60)
+    store.upsert_fs_chunk(FSChunk(id="a", type="extractive", text="x", src_turn=1))
+    with ThreadPoolExecutor(1) as pool:
+        # the pending write is visible from another thread
+        assert pool.submit(store.count_fs).result() == 1
+        with store.batch():
+            store.upsert_fs_chunk(FSChunk(id="b", type="extractive", text="y", src_turn=1))
+            read = pool.submit(store.count_fs)
+            time.sleep(0.2)
+            # neither the committed snapshot nor half of the batch: the read waits for it
+            assert not read.done()
+        assert read.result() == 2
+    store.close()
+
+
+def test_exclusive_holds_off_other_writers(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    store = Store(str(tmp_path / "ctx.db"))
+    with ThreadPoolExecutor(1) as pool:
+        with store.exclusive():
+            write = pool.submit(store.upsert_fs_chunk, FSChunk(id="a", type="extractive", text="x", src_turn=1))
+            time.sleep(0.1)
+            assert not write.done()
+            # not a batch: writes inside still commit on their own
+            store.upsert_fs_chunk(FSChunk(id="b", type="extractive", text="y", src_turn=1))
+            assert Store(store.db_path).count_fs() == 1
+        write.result()
+    assert store.count_fs() == 2
+    store.close()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from context_engine.embeddings import HashEmbedder
+from context_engine.models import FSChunk
+from context_engine.store import Store
+from context_engine import vector_index
+
+pytestmark = pytest.mark.skipif(vector_index.faiss is None, reason="faiss not installed")
+
+
+def test_vector_index_replace_and_replay(tmp_path):
+    store = Store(str(tmp_path / "ctx.db"))
+    emb = HashEmbedder()
+    texts = [f"chunk number {i}" for i in range(50)]
+    vecs = emb.encode(texts)
+    idx = vector_index.VectorIndex(str(tmp_path / "indexes"))
+    for i, (t, v) in enumerate(zip(texts, vecs)):
+        store.upsert_fs_chunk(FSChunk(id=str(i), type="extractive", text=t, src_turn=i, vec=v))
+        idx.add(str(i), v)
+    assert idx.search(vecs[7], 1)[0][0] == "7"
+    # a merged chunk gets a new vector; the old one becomes a tombstone
+    store.upsert_fs_chunk(FSChunk(id="7", type="extractive", text="merged", src_turn=7, vec=vecs[8]))
+    idx.add("7", vecs[8])
+    hits = dict(idx.search(vecs[7], 5))
+    assert hits.get("7", 0) < 0.99 and idx.stale == 1
+    # reopening without a save replays the label tail from the store
+    reopened = vector_index.VectorIndex(str(tmp_path / "indexes"))
+    reopened.sync(store)
+    assert reopened.index.ntotal == 51 and len(reopened) == 50
+    assert {cid for cid, _ in reopened.search(vecs[8], 2)} == {"7", "8"}
+    assert np.isclose(reopened.search(vecs[3], 1)[0][1], 1.0, atol=1e-5)
+
+
+def test_quantized_hnsw_rescores_from_store(tmp_path):
+    store = Store(str(tmp_path / "ctx.db"), vec_dtype="int8")
+    vecs = HashEmbedder().encode([f"chunk number {i}" for i in range(300)])
+    store.upsert_fs_chunks([FSChunk(id=str(i), type="extractive", text="t", src_turn=i, vec=v)
+                            for i, v in enumerate(vecs)])
+    idx = vector_index.open_vector_index(store, name="fs")
+    idx.sync(store)
+    assert idx.index_path.endswith("fs.i8.hnsw") and len(idx) == 300
+    for q, hits in zip(vecs[:30], idx.search_many(vecs[:30], 3)):
+        # scores are the store's dequantized vectors against the float32 query, best first
+        _, stored = store.vectors([cid for cid, _ in hits])
+        assert np.allclose([s for _, s in hits], stored @ q, atol=1e-5)
+        assert [s for _, s in hits] == sorted((s for _, s in hits), reverse=True)
+    assert [hits[0][0] for hits in idx.search_many(vecs[:30], 1)] == [str(i) for i in range(30)]
+
+
+def test_dtype_switch_drops_old_index_and_sync_checks_ids(tmp_path):
+    import os
+    db = str(tmp_path / "ctx.db")
+    vecs = HashEmbedder().encode([f"chunk number {i}" for i in range(20)])
+    chunk = lambda i: FSChunk(id=str(i), type="extractive", text="t", src_turn=i, vec=vecs[i])
+    store = Store(db)
+    store.upsert_fs_chunks([chunk(i) for i in range(10)])
+    idx = vector_index.open_vector_index(store, name="fs")
+    idx.sync(store)
+    store.close()
+    for dtype in ("int8", "float16", "float32"):
+        store = Store(db, vec_dtype=dtype)
+        idx = vector_index.open_vector_index(store, name="fs")
+        idx.sync(store)
+        store.close()
+    assert sorted(f for f in os.listdir(store.index_dir) if f.startswith("fs.")) == ["fs.hnsw", "fs.labels"]
+    # same count, different chunks: the index is rebuilt rather than reused
+    store = Store(db)
+    store.delete_fs_chunks(["9"])
+    store.upsert_fs_chunk(chunk(10))
+    idx = vector_index.open_vector_index(store, name="fs")
+    idx.sync(store)
+    assert "9" not in idx.current and idx.search(vecs[10], 1)[0][0] == "10"